@@ -0,0 +1,102 @@
+"""
+Comparison of the CSV engines of PrepFilesBQ (c, python, pyarrow) on the same corpus.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_csv_engines --rows 200000 --files 4
+    python -m benchmarks.bench_csv_engines --folder data/raw_datasets
+
+Without --folder, a synthetic corpus of semicolon separated files shaped like the CNIL exports is
+written to a temporary folder (some of them with a title row above the headers). Every file is opened
+with open_df once per engine, and the DataFrames are compared with the ones of the C engine, which is
+the reference. A file read by the fallback to the C engine is timed with its failed attempt.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import warnings
+import pandas as pd
+from classes.list_files import FolderLister
+from classes.prep_data import PrepFilesBQ
+
+
+def make_corpus(folder, n_files, n_rows, seed=0):
+    """
+    Write a synthetic corpus of CSV files.
+
+    Parameters:
+    - folder (str): Folder where the files are written.
+    - n_files (int): Number of files.
+    - n_rows (int): Number of rows of each file.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - list: Paths of the files.
+    """
+    rng = random.Random(seed)
+    sectors = ['Santé', 'Éducation', 'Collectivité territoriale', 'Banque; assurance', 'Télécommunications']
+    sanctions = ['Avertissement', 'Mise en demeure', 'Amende', 'Rappel à l\'ordre']
+    paths = []
+    for index in range(n_files):
+        path = os.path.join(folder, f'opencnil_synthetic_{index}.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if index % 2:
+                f.write('Données publiées par la CNIL\n')
+            f.write('Année;Secteur;Type de sanction;Montant (€);Date de la décision;Nombre de plaintes\n')
+            for _ in range(n_rows):
+                f.write(f'{rng.randint(1984, 2024)};"{rng.choice(sectors)}";{rng.choice(sanctions)};'
+                        f'{rng.randint(0, 5_000_000)};{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2000, 2024)};'
+                        f'{rng.randint(0, 20000)}\n')
+        paths.append(path)
+    return paths
+
+
+def open_quietly(prep, path):
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return prep.open_df(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder', help='folder of raw CSV files, a synthetic corpus is used if not set')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--engines', nargs='+', default=PrepFilesBQ.engines)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.folder:
+            paths = [entry.path for entry in FolderLister(args.folder).iter_files(extensions=['.csv', ''])]
+        else:
+            paths = make_corpus(temp_dir, args.files, args.rows)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f'{len(paths)} files, {size / 1e6:.1f} MB')
+
+        reference = {}
+        for engine in ['c'] + [engine for engine in args.engines if engine != 'c']:
+            prep = PrepFilesBQ(engine=engine)
+            elapsed = 0.0
+            same = 0
+            for path in paths:
+                start = time.perf_counter()
+                df = open_quietly(prep, path)
+                elapsed += time.perf_counter() - start
+                if engine == 'c':
+                    reference[path] = df
+                    same += 1
+                elif df is not None and reference[path] is not None:
+                    # dtypes may differ between engines, the values are compared as written by prep
+                    same += df.to_csv(index=False) == reference[path].to_csv(index=False)
+                else:
+                    same += df is None and reference[path] is None
+            if engine in args.engines:
+                print(f'{engine:>8}: {elapsed:7.2f} s, {size / 1e6 / elapsed:6.1f} MB/s, '
+                      f'{same}/{len(paths)} files identical to the C engine')
+
+
+if __name__ == '__main__':
+    main()
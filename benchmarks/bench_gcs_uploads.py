@@ -0,0 +1,49 @@
+"""
+Benchmark of FromFileToGCS.local_to_gcs, sequential and concurrent, against a FakeStorageClient.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_gcs_uploads --files 200 --latency 0.05 --workers 1 8 16
+
+No request leaves the machine: each upload of the fake client waits for --latency seconds, which stands
+for the round trips of a real upload. The files are written to a temporary folder.
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from benchmarks.fake_clients import FakeStorageClient
+from classes.file_to_gcs import FromFileToGCS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=64 * 1024, help='size of each file in bytes')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each fake upload takes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16], help='1 for sequential uploads')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = []
+        for index in range(args.files):
+            path = os.path.join(temp_dir, f'table_{index}.csv')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.size))
+            paths.append(path)
+
+        for workers in args.workers:
+            client = FakeStorageClient(latency=args.latency)
+            uploader = FromFileToGCS('benchmark', None, storage_client=client)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = uploader.local_to_gcs(paths, 'prep', max_workers=None if workers == 1 else workers)
+            elapsed = time.perf_counter() - start
+            uploaded = sum(result['error'] is None for result in results)
+            print(f'{workers:>3} workers: {elapsed:6.2f} s, {uploaded}/{args.files} files uploaded, '
+                  f"{client.calls.get('bucket', 0)} bucket handle(s)")
+
+
+if __name__ == '__main__':
+    main()
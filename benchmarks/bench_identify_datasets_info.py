@@ -0,0 +1,89 @@
+"""
+Benchmark of GetCnilCatalog.identify_datasets_info against the previous row by row implementation.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_identify_datasets_info --resources 50000 --datasets 5000
+
+The previous implementation scans every dataset ID for every catalog row, so it is only timed on
+a sample of rows (--legacy-sample) and the total time is extrapolated. Both results are compared
+on that sample.
+"""
+import argparse
+import random
+import time
+import uuid
+import pandas as pd
+from classes.source_catalog import GetCnilCatalog
+
+
+def make_catalog(n_resources, n_datasets, seed=0):
+    """
+    Build a synthetic catalog and dataset list shaped like the data.gouv.fr ones.
+
+    Parameters:
+    - n_resources (int): Number of catalog rows (resources).
+    - n_datasets (int): Number of datasets.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - tuple: (df_catalog, df_dataset)
+    """
+    rng = random.Random(seed)
+    dataset_ids = ['%024x' % rng.getrandbits(96) for _ in range(n_datasets)]
+    rows = []
+    for _ in range(n_resources):
+        resource_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        dataset_id = rng.choice(dataset_ids)
+        rows.append({
+            'table_id': resource_id,
+            'accessURL': f'https://www.data.gouv.fr/datasets/{dataset_id}/#resource-{resource_id}'
+        })
+    df_catalog = pd.DataFrame(rows)
+    df_dataset = pd.DataFrame({'id': dataset_ids, 'slug': [f'dataset-{i}' for i in range(n_datasets)]})
+    return df_catalog, df_dataset
+
+
+def legacy_identify_datasets_info(catalog):
+    """
+    Previous implementation of identify_datasets_info, kept as the reference.
+    """
+    def find_dataset_id(row):
+        for dataset_id in catalog.df_dataset.id:
+            if dataset_id in row['accessURL']:
+                return dataset_id
+
+    return catalog.df_catalog.apply(lambda row: find_dataset_id(row), axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=50000)
+    parser.add_argument('--datasets', type=int, default=5000)
+    parser.add_argument('--legacy-sample', type=int, default=2000)
+    args = parser.parse_args()
+
+    df_catalog, df_dataset = make_catalog(args.resources, args.datasets)
+    catalog = GetCnilCatalog(url=None, headers=None, url_additional_info=None)
+    catalog.df_dataset = df_dataset
+
+    catalog.df_catalog = df_catalog.copy()
+    start = time.perf_counter()
+    result = catalog.identify_datasets_info()['dataset_id']
+    indexed_time = time.perf_counter() - start
+
+    sample = min(args.legacy_sample, args.resources)
+    catalog.df_catalog = df_catalog.head(sample).copy()
+    start = time.perf_counter()
+    expected = legacy_identify_datasets_info(catalog)
+    legacy_time = (time.perf_counter() - start) * args.resources / sample
+
+    same = list(result.head(sample)) == list(expected)
+    print(f'{args.resources} resources, {args.datasets} datasets')
+    print(f'indexed matcher : {indexed_time:.3f}s')
+    print(f'row by row scan : {legacy_time:.3f}s (extrapolated from {sample} rows)')
+    print(f'speedup         : {legacy_time / indexed_time:.0f}x')
+    print(f'same result on the sample: {same}')
+
+
+if __name__ == '__main__':
+    main()
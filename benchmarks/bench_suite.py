@@ -0,0 +1,162 @@
+"""
+Offline benchmark suite of the pipeline on a synthetic CNIL-like corpus (see benchmarks/corpus.py).
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --datasets 40 --rows 20000 --output bench.json
+    python -m benchmarks.bench_suite --baseline bench.json --tolerance 0.2
+
+Times, without any network access:
+- open_df: PrepDataCnilBQ.open_df on every raw file written to a temporary folder;
+- process_zip_file: PrepDataCnilBQ.process_zip_file on the raw archive;
+- create_catalog_gcs: CustomCatalog.create_catalog_gcs on the prepped archive and on --members member names,
+  with a FakeBigQueryClient;
+- identify_datasets_info: GetCnilCatalog.identify_datasets_info on --resources catalog rows.
+
+Each benchmark is run --repeat times and its best time is kept. With --baseline, the times are compared
+with those of a previous --output file, and the command fails if one of them is slower by more than --tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+import zipfile
+from benchmarks.bench_identify_datasets_info import make_catalog
+from benchmarks.corpus import make_members, make_manifest_names, write_zip
+from benchmarks.fake_clients import FakeBigQueryClient, fake_bigquery_tables
+from classes.prep_data import PrepDataCnilBQ
+from classes.source_catalog import CustomCatalog, GetCnilCatalog
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+def best_time(function, repeat):
+    """
+    Best wall time of repeat calls of function, and the result of the last call.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with quiet():
+            result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_open_df(members, temp_dir, repeat):
+    paths = []
+    for name, content in members.items():
+        if name.endswith('/'):
+            continue
+        path = os.path.join(temp_dir, 'raw', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        paths.append((name, path))
+    prep = PrepDataCnilBQ()
+
+    def open_all():
+        # open_df relies on the extension of the path, the file itself is read from disk
+        return sum(prep.open_df(name, path) is not None for name, path in paths)
+
+    seconds, opened = best_time(open_all, repeat)
+    return seconds, f'{opened}/{len(paths)} files opened'
+
+
+def bench_process_zip_file(zip_path, repeat):
+    def process():
+        with zipfile.ZipFile(zip_path) as zip_file:
+            output = PrepDataCnilBQ().process_zip_file(zip_file)
+        return output.read()
+
+    seconds, prepped = best_time(process, repeat)
+    with zipfile.ZipFile(io.BytesIO(prepped)) as zip_file:
+        n_members = len(zip_file.namelist())
+    return seconds, f'{n_members} prepped members', prepped
+
+
+def bench_create_catalog_gcs(prepped, n_members, repeat):
+    catalog = CustomCatalog(None, project_id='benchmark', dataset_name='raw_cnil',
+                            bq_client=FakeBigQueryClient('benchmark', fake_bigquery_tables(5, 20)))
+    with zipfile.ZipFile(io.BytesIO(prepped)) as zip_file:
+        archive_seconds, df = best_time(lambda: catalog.create_catalog_gcs(zip_file), repeat)
+    names = make_manifest_names(n_members)
+    names_seconds, _ = best_time(lambda: catalog.create_catalog_gcs(names), repeat)
+    return archive_seconds + names_seconds, (f'prepped archive ({len(df)} rows) {archive_seconds:.3f} s, '
+                                             f'{n_members} names {names_seconds:.3f} s')
+
+
+def bench_identify_datasets_info(n_resources, n_datasets, repeat):
+    df_catalog, df_dataset = make_catalog(n_resources, n_datasets)
+    catalog = GetCnilCatalog(url=None, headers=None, url_additional_info=None)
+    catalog.df_dataset = df_dataset
+
+    def identify():
+        catalog.df_catalog = df_catalog.copy()
+        return catalog.identify_datasets_info()
+
+    seconds, df = best_time(identify, repeat)
+    return seconds, f"{df['dataset_id'].notna().sum()}/{n_resources} resources matched"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=10, help='dataset folders of the raw archive')
+    parser.add_argument('--rows', type=int, default=2000, help='rows of the list files')
+    parser.add_argument('--years', type=int, default=30, help='year columns of the wide files')
+    parser.add_argument('--members', type=int, default=50000, help='member names given to create_catalog_gcs')
+    parser.add_argument('--resources', type=int, default=50000, help='catalog rows given to identify_datasets_info')
+    parser.add_argument('--catalog-datasets', type=int, default=5000, help='datasets given to identify_datasets_info')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='JSON file written by a previous --output to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown allowed against the baseline')
+    args = parser.parse_args()
+
+    members = make_members(args.datasets, args.rows, args.years)
+    size = sum(len(content) for content in members.values())
+    print(f'{len(members) - args.datasets} raw files, {size / 1e6:.1f} MB')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        zip_path = write_zip(members, os.path.join(temp_dir, 'raw.zip'))
+        results['open_df'] = bench_open_df(members, temp_dir, args.repeat)
+        seconds, detail, prepped = bench_process_zip_file(zip_path, args.repeat)
+        results['process_zip_file'] = seconds, detail
+    results['create_catalog_gcs'] = bench_create_catalog_gcs(prepped, args.members, args.repeat)
+    results['identify_datasets_info'] = bench_identify_datasets_info(args.resources, args.catalog_datasets, args.repeat)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['seconds']
+    regressions = []
+    for name, (seconds, detail) in results.items():
+        line = f'{name:>24}: {seconds:8.3f} s  {detail}'
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f'  ({ratio:.2f}x the baseline)'
+            if ratio > 1 + args.tolerance:
+                regressions.append(name)
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'arguments': vars(args), 'seconds': {name: seconds for name, (seconds, _) in results.items()}}, f, indent=2)
+    if regressions:
+        print(f"slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Synthetic corpora shaped like the CNIL open data archive, for the benchmarks.
+
+The raw archive holds one folder per dataset, and files named '<resource>_vYYYY-MM-DD<.ext>' in them:
+- lists separated by commas or semicolons, some with a title row above the headers;
+- wide tables with one column per year, which PrepDataCnilBQ.transposed turns into one row per year;
+- xlsx twins of some CSV files, and files without extension holding CSV text.
+"""
+import io
+import random
+import zipfile
+import pandas as pd
+
+SECTORS = ['Santé', 'Éducation', 'Collectivité territoriale', 'Banque; assurance', 'Télécommunications', 'Commerce']
+SANCTIONS = ['Avertissement', 'Mise en demeure', 'Amende', "Rappel à l'ordre"]
+INDICATORS = ['Budget (k€)', 'Effectifs', 'Plaintes reçues', 'Contrôles réalisés', 'Sanctions prononcées']
+
+
+def list_frame(rng, n_rows):
+    """
+    Table of controls or sanctions, one row per decision.
+    """
+    return pd.DataFrame({
+        'Année': [rng.randint(1984, 2024) for _ in range(n_rows)],
+        'Secteur': [rng.choice(SECTORS) for _ in range(n_rows)],
+        'Type de sanction': [rng.choice(SANCTIONS) for _ in range(n_rows)],
+        'Montant (€)': [rng.randint(0, 5_000_000) for _ in range(n_rows)],
+        'Date de la décision': [f'{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2000, 2024)}' for _ in range(n_rows)],
+        'Nombre de plaintes': [rng.randint(0, 20000) for _ in range(n_rows)],
+        'Commentaire': [None] * n_rows
+    })
+
+
+def wide_frame(rng, n_years):
+    """
+    Indicators with one column per year, like the budget and staff files.
+    """
+    years = [str(year) for year in range(2024 - n_years, 2024)]
+    rows = [[indicator] + [rng.randint(0, 100000) for _ in years] for indicator in INDICATORS]
+    return pd.DataFrame(rows, columns=['Année'] + years)
+
+
+def csv_bytes(df, sep, title=None):
+    text = df.to_csv(index=False, sep=sep)
+    if title is not None:
+        text = title + '\n' + text
+    return text.encode('utf-8')
+
+
+def xlsx_bytes(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def make_members(n_datasets=10, n_rows=2000, n_years=30, seed=0):
+    """
+    Build the members of a synthetic raw archive.
+
+    Parameters:
+    - n_datasets (int): Number of dataset folders, each holding 5 or 6 files.
+    - n_rows (int): Number of rows of the list files.
+    - n_years (int): Number of year columns of the wide files.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - dict: Content of each member, keyed by member name, in the order of the archive.
+    """
+    rng = random.Random(seed)
+    members = {}
+    for index in range(n_datasets):
+        folder = f'synthetic-dataset-{index}-de-la-cnil'
+        version = f'v{rng.randint(2015, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+        members[folder + '/'] = b''
+        listing = list_frame(rng, n_rows)
+        members[f'{folder}/opencnil-liste-controles-{index}_{version}.csv'] = csv_bytes(listing, ';')
+        members[f'{folder}/opencnil-liste-controles-{index}_{version}.xlsx'] = xlsx_bytes(listing.head(min(n_rows, 1000)))
+        members[f'{folder}/open-data-sanctions-{index}_{version}.csv'] = csv_bytes(list_frame(rng, n_rows), ',')
+        members[f'{folder}/opencnil-decisions-{index}-maj-juin-2023_{version}.csv'] = \
+            csv_bytes(list_frame(rng, n_rows), ';', title='Données publiées par la CNIL')
+        members[f'{folder}/opencnil-indicateurs-depuis-{2024 - n_years}_{version}.csv'] = csv_bytes(wide_frame(rng, n_years), ';')
+        if index % 2 == 0:
+            members[f'{folder}/Liste des contrôles réalisés par la CNIL en {2014 + index}_{version}'] = \
+                csv_bytes(list_frame(rng, n_rows), ';')
+    return members
+
+
+def write_zip(members, output):
+    """
+    Write members returned by make_members to a zip archive (path or binary file), and return it.
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return output
+
+
+def make_manifest_names(n_members, seed=0):
+    """
+    Member names of a large prepped archive, as PrepFilesBQ writes them, for the catalog benchmarks.
+    """
+    rng = random.Random(seed)
+    names = []
+    for index in range(n_members):
+        folder = f'synthetic_dataset_{index % 500}_de_la_cnil'
+        table = rng.choice(['opencnil_liste_controles', 'Liste_des_contrôles_réalisés', 'open_data_sanctions'])
+        extension = rng.choice(['_csv', '_xlsx', ''])
+        names.append(f'{folder}/{table}_{index}_v{rng.randint(2015, 2024)}_{rng.randint(1, 12):02d}_{rng.randint(1, 28):02d}{extension}.csv')
+    return names
@@ -0,0 +1,278 @@
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+class FakeDataset:
+    """
+    In-memory stand-in for a BigQuery dataset (and its reference).
+    """
+    def __init__(self, project, dataset_id):
+        self.project = project
+        self.dataset_id = dataset_id
+        self.reference = self
+
+
+class FakeTable:
+    """
+    In-memory stand-in for a BigQuery table (and its reference).
+    """
+    def __init__(self, project, dataset_id, table_id, modified):
+        self.project = project
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+        self.modified = modified
+        self.reference = self
+
+
+class FakeQueryJob:
+    """
+    In-memory stand-in for a BigQuery query job, result() returns the rows as dicts.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return iter(self.rows)
+
+
+class FakeBigQueryClient:
+    """
+    A local fake of google.cloud.bigquery.Client, used to run the catalog code offline in the benchmarks.
+
+    Only the calls used by CustomCatalog are implemented: list_datasets, get_dataset, list_tables,
+    get_table and query on __TABLES__. Every call is counted in `calls`, so the number of API round
+    trips of a method can be checked.
+
+    Attributes
+    ----------
+    project : str
+        default project of the client
+    tables : dict
+        modified datetime of each table, keyed by dataset ID then table ID
+    supports_metadata_query : bool
+        if False, query() raises like a client without access to __TABLES__
+    calls : dict
+        number of calls of each method
+    """
+
+    def __init__(self, project, tables, supports_metadata_query=True):
+        self.project = project
+        self.tables = tables
+        self.supports_metadata_query = supports_metadata_query
+        self.calls = {}
+
+    def count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    def dataset_id(self, dataset):
+        if isinstance(dataset, str):
+            return dataset.split('.')[-1]
+        return dataset.dataset_id
+
+    def list_datasets(self):
+        self.count('list_datasets')
+        return [FakeDataset(self.project, dataset_id) for dataset_id in self.tables]
+
+    def get_dataset(self, dataset):
+        self.count('get_dataset')
+        return FakeDataset(self.project, self.dataset_id(dataset))
+
+    def list_tables(self, dataset):
+        self.count('list_tables')
+        dataset_id = self.dataset_id(dataset)
+        return [FakeTable(self.project, dataset_id, table_id, modified)
+                for table_id, modified in self.tables[dataset_id].items()]
+
+    def get_table(self, table):
+        self.count('get_table')
+        modified = self.tables[table.dataset_id][table.table_id]
+        return FakeTable(self.project, table.dataset_id, table.table_id, modified)
+
+    def query(self, sql):
+        self.count('query')
+        if not self.supports_metadata_query:
+            raise PermissionError('Access Denied: __TABLES__ metadata is not readable')
+        rows = []
+        for project, dataset_id in re.findall(r'`([^`.]+)\.([^`.]+)\.__TABLES__`', sql):
+            for table_id, modified in self.tables[dataset_id].items():
+                rows.append({'dataset_id': dataset_id, 'table_id': table_id, 'modified': modified})
+        return FakeQueryJob(rows)
+
+
+def fake_bigquery_tables(n_datasets, n_tables, modified=None):
+    """
+    Build the `tables` argument of FakeBigQueryClient for n_datasets datasets of n_tables tables each.
+    """
+    if modified is None:
+        modified = datetime(2024, 2, 17, tzinfo=timezone.utc)
+    return {f'dataset_{i}': {f'Table_{j}_20240217': modified for j in range(n_tables)} for i in range(n_datasets)}
+
+
+class FakeBlobWriter:
+    """
+    In-memory stand-in for the writer returned by blob.open('wb'): the data is sent in chunks of chunk_size
+    bytes, and the blob is only created when the writer is closed. Exiting on an exception cancels the upload.
+    """
+    def __init__(self, blob, chunk_size, content_type):
+        self.blob = blob
+        self.chunk_size = chunk_size
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.parts = []
+        self.closed = False
+        # largest number of bytes held by the writer before being sent, at most chunk_size plus one write
+        self.max_buffered = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.max_buffered = max(self.max_buffered, len(self.buffer))
+        while len(self.buffer) >= self.chunk_size:
+            self.blob.client.count('upload_chunk')
+            self.blob.client.wait()
+            self.parts.append(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.blob.store('finalize_upload', b''.join(self.parts) + bytes(self.buffer), self.content_type)
+
+    def terminate(self):
+        self.blob.client.count('terminate')
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.terminate()
+        else:
+            self.close()
+
+
+class FakeBlob:
+    """
+    In-memory stand-in for a GCS blob, its content is kept by the FakeStorageClient.
+    """
+    def __init__(self, client, bucket_name, name, chunk_size=None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_type = None
+        # writer of the last blob.open('wb')
+        self.writer = None
+
+    @property
+    def size(self):
+        stored = self.client.blobs.get((self.bucket_name, self.name))
+        return None if stored is None else len(stored[0])
+
+    def store(self, method, data, content_type):
+        self.client.count(method)
+        self.client.wait()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.content_type = content_type
+        with self.client.lock:
+            self.client.blobs[(self.bucket_name, self.name)] = (bytes(data), content_type)
+
+    def upload_from_filename(self, filename, content_type=None, timeout=None):
+        with open(filename, 'rb') as f:
+            self.store('upload_from_filename', f.read(), content_type)
+
+    def upload_from_file(self, file_obj, content_type=None, timeout=None):
+        self.store('upload_from_file', file_obj.read(), content_type)
+
+    def upload_from_string(self, data, content_type='text/plain', timeout=None):
+        self.store('upload_from_string', data, content_type)
+
+    def open(self, mode='r', chunk_size=None, content_type=None, **kwargs):
+        if mode != 'wb':
+            raise NotImplementedError(f'FakeBlob.open only supports mode wb, got {mode!r}')
+        chunk_size = chunk_size or self.chunk_size or 40 * 1024 * 1024
+        if chunk_size % (256 * 1024):
+            raise ValueError('chunk_size must be a multiple of 256 KB')
+        self.client.count('open')
+        self.writer = FakeBlobWriter(self, chunk_size, content_type)
+        return self.writer
+
+    def exists(self):
+        return (self.bucket_name, self.name) in self.client.blobs
+
+    def download_as_bytes(self):
+        self.client.count('download_as_bytes')
+        return self.client.blobs[(self.bucket_name, self.name)][0]
+
+
+class FakeBucket:
+    """
+    In-memory stand-in for a GCS bucket.
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.storage_class = None
+
+    def blob(self, blob_name, chunk_size=None):
+        return FakeBlob(self.client, self.name, blob_name, chunk_size)
+
+    def exists(self):
+        return True
+
+
+class FakeStorageClient:
+    """
+    A local fake of google.cloud.storage.Client, used to run the GCS code offline in the benchmarks and tests.
+
+    Only the calls used by FromFileToGCS are implemented: bucket, get_bucket, create_bucket, list_blobs
+    and the uploads and downloads of blobs. Every call is counted in `calls`, and each upload waits for
+    `latency` seconds, so that concurrent uploads can be compared with sequential ones. The client is
+    thread safe.
+
+    Attributes
+    ----------
+    project : str
+        default project of the client
+    latency : float
+        seconds each upload takes
+    blobs : dict
+        content and content type of each blob, keyed by (bucket name, blob name)
+    calls : dict
+        number of calls of each method
+    """
+
+    def __init__(self, project='fake-project', latency=0.0):
+        self.project = project
+        self.latency = latency
+        self.blobs = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def bucket(self, bucket_name):
+        self.count('bucket')
+        return FakeBucket(self, bucket_name)
+
+    def get_bucket(self, bucket_name):
+        self.count('get_bucket')
+        return FakeBucket(self, bucket_name)
+
+    def create_bucket(self, bucket, location=None):
+        self.count('create_bucket')
+        return bucket
+
+    def list_blobs(self, bucket_name, prefix=''):
+        self.count('list_blobs')
+        return [FakeBlob(self, name[0], name[1]) for name in sorted(self.blobs)
+                if name[0] == bucket_name and name[1].startswith(prefix)]
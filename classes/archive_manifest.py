@@ -0,0 +1,89 @@
+import pandas as pd
+from unidecode import unidecode
+
+class ArchiveManifest:
+    """
+    Class for parsing the member names of a prepped archive into a typed DataFrame.
+
+    Members are named '<dataset>/<table>_v<YYYY>_<MM>_<DD>_<ext>.csv' (or '.parquet') by PrepFilesBQ, where <ext>
+    is the format of the raw file and is missing for raw files without extension. All the names are parsed at
+    once with a single str.extract, and unidecode is only called once per distinct table name. The BigQuery
+    schemas written next to the members ('<member>.schema.json') are not members themselves.
+
+    Attributes:
+    - names (list): Member names of the archive, directories and schemas excluded.
+    - schemas (set): Names of the schemas of the members.
+
+    Methods:
+    - __init__(zip_file_or_names): Constructor method that initializes the object with an archive or its namelist().
+    - transliterate(prefixes): Helper method to transliterate and lower the table names.
+    - parse(dataset_name): Parses the member names into a DataFrame.
+    """
+
+    pattern = (r'^(?:(?P<folder>.*)/)?(?P<prefix>[^/]*)'
+               r'_v(?P<year>\d{4})[-_](?P<month>\d{2})[-_](?P<day>\d{2})'
+               r'(?:_(?P<ext>[A-Za-z0-9]+))?(?:\.(?P<suffix>[A-Za-z0-9]+))?$')
+
+    def __init__(self, zip_file_or_names):
+        """
+        Initialize the ArchiveManifest object.
+
+        Parameters:
+        - zip_file_or_names (zipfile.ZipFile or list): Archive, or the list returned by its namelist().
+        """
+        if hasattr(zip_file_or_names, 'namelist'):
+            zip_file_or_names = zip_file_or_names.namelist()
+        self.schemas = {name for name in zip_file_or_names if name.endswith('.schema.json')}
+        self.names = [name for name in zip_file_or_names if not name.endswith('/') and name not in self.schemas]
+
+    def transliterate(self, prefixes):
+        """
+        Transliterate the table names to ASCII and lower them, once per distinct name.
+
+        Parameters:
+        - prefixes (pd.Series): Table names extracted from the member names.
+
+        Returns:
+        - pd.Series: Transliterated table names.
+        """
+        mapping = {prefix: (prefix if prefix.isascii() else unidecode(prefix)).lower() for prefix in prefixes.dropna().unique()}
+        return prefixes.map(mapping)
+
+    def parse(self, dataset_name=None):
+        """
+        Parse the member names into a DataFrame.
+
+        Parameters:
+        - dataset_name (str): BigQuery dataset prefixed to the destination tables, not prefixed if None.
+
+        Returns:
+        - pd.DataFrame: One row per member with the columns member, folder, filename, updated_at (datetime),
+          source_format ('csv', 'xlsx', ... or 'no extension'), file_format (format of the member itself),
+          bq_dest_table and schema_member (name of its schema, None if it has none).
+        """
+        members = pd.Series(self.names, dtype=object)
+        parts = members.str.extract(self.pattern)
+
+        # names without a version keep their full base name and have no date
+        unmatched = parts['prefix'].isna()
+        if unmatched.any():
+            names = members[unmatched].str.extract(r'^(?:(?P<folder>.*)/)?(?P<prefix>[^/]*?)(?:\.(?P<suffix>[A-Za-z0-9]+))?$')
+            parts.loc[unmatched, ['folder', 'prefix', 'suffix']] = names[['folder', 'prefix', 'suffix']]
+
+        filename = self.transliterate(parts['prefix'])
+        updated_at = pd.to_datetime(parts['year'] + '-' + parts['month'] + '-' + parts['day'], format='%Y-%m-%d', errors='coerce')
+        if dataset_name is not None:
+            bq_dest_table = dataset_name + '.' + filename
+        else:
+            bq_dest_table = filename
+
+        return pd.DataFrame({
+            'member': members,
+            'folder': parts['folder'],
+            'filename': filename,
+            'updated_at': updated_at,
+            'source_format': parts['ext'].str.lower().fillna('no extension'),
+            'file_format': parts['suffix'].str.lower(),
+            'bq_dest_table': bq_dest_table,
+            'schema_member': [name + '.schema.json' if name + '.schema.json' in self.schemas else None for name in self.names]
+        })
@@ -0,0 +1,167 @@
+import re
+import sys
+import warnings
+from contextlib import contextmanager
+from pandas.errors import ParserError, ParserWarning
+
+class BadLinesError(ParserError):
+    """
+    Raised when a file has more bad lines than the policy of its BadLinesReport allows.
+    """
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class BadLinesReport:
+    """
+    Class for counting the lines skipped by pandas.read_csv while a file is parsed.
+
+    The bad lines are reported by the parser itself, through an on_bad_lines callable for the python and
+    pyarrow engines and through the warnings of on_bad_lines='warn' for the C engine. The file is not read
+    a second time, and quoted fields spanning several lines are counted as one row. pyarrow decodes a bad line
+    as UTF-8 before calling on_bad_lines, a line it can't decode (e.g. in a latin-1 file read without its
+    encoding) is counted by capture() with a placeholder sample.
+
+    Attributes:
+    - max_ratio (float): Maximum share of skipped rows, e.g. 0.01 for 1%. No limit if None.
+    - n_samples (int): Number of bad lines kept as samples.
+    - rows (int): Number of rows parsed.
+    - skipped (int): Number of rows skipped.
+    - samples (list): First bad lines, as text (or a parser message for the C engine).
+
+    Methods:
+    - __init__(max_ratio, n_samples): Constructor method that initializes an empty report.
+    - read_options(kwargs): Adds the on_bad_lines option matching the engine to read_csv options.
+    - capture(): Context manager counting the bad lines reported as warnings by the C engine, or not decoded by pyarrow.
+    - check(rows): Records the number of rows parsed and applies the policy.
+    - to_dict(path): Returns the report as a dict.
+    - from_dict(report, max_ratio): Builds a report back from to_dict.
+    """
+
+    warning_pattern = re.compile(r'Skipping line (\d+): (.*)')
+
+    def __init__(self, max_ratio=0.01, n_samples=5):
+        """
+        Initialize the BadLinesReport object.
+
+        Parameters:
+        - max_ratio (float): Maximum share of skipped rows, no limit if None.
+        - n_samples (int): Number of bad lines kept as samples.
+        """
+        self.max_ratio = max_ratio
+        self.n_samples = n_samples
+        self.rows = 0
+        self.skipped = 0
+        self.samples = []
+
+    def add(self, sample):
+        self.skipped += 1
+        if len(self.samples) < self.n_samples:
+            self.samples.append(sample)
+
+    def on_python_bad_line(self, fields):
+        # returning None skips the line
+        self.add('|'.join(fields))
+        return None
+
+    def on_pyarrow_bad_line(self, row):
+        self.add(row.text)
+        return 'skip'
+
+    def read_options(self, kwargs):
+        """
+        Add the on_bad_lines option matching the engine to read_csv options, unless it is already set.
+
+        Parameters:
+        - kwargs (dict): Options of pd.read_csv.
+
+        Returns:
+        - dict: Options with on_bad_lines set.
+        """
+        kwargs = dict(kwargs)
+        if 'on_bad_lines' not in kwargs:
+            engine = kwargs.get('engine')
+            if engine == 'python':
+                kwargs['on_bad_lines'] = self.on_python_bad_line
+            elif engine == 'pyarrow':
+                kwargs['on_bad_lines'] = self.on_pyarrow_bad_line
+            else:
+                kwargs['on_bad_lines'] = 'warn'
+        return kwargs
+
+    @contextmanager
+    def capture(self):
+        """
+        Count the bad lines reported as ParserWarning by the C engine, other warnings are emitted again, and the
+        bad lines pyarrow couldn't decode.
+        """
+        previous_hook = sys.unraisablehook
+
+        def on_unraisable(unraisable):
+            # pyarrow decodes the text of a bad line before calling on_pyarrow_bad_line, and only reports its failure
+            if isinstance(unraisable.exc_value, UnicodeDecodeError) and unraisable.object == self.on_pyarrow_bad_line:
+                self.add('<bad line not valid UTF-8>')
+            else:
+                previous_hook(unraisable)
+
+        sys.unraisablehook = on_unraisable
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                yield self
+        finally:
+            sys.unraisablehook = previous_hook
+        for warning in caught:
+            matches = self.warning_pattern.findall(str(warning.message)) if issubclass(warning.category, ParserWarning) else []
+            if not matches:
+                warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+            for line, message in matches:
+                self.add(f'line {line}: {message}')
+
+    @property
+    def total(self):
+        return self.rows + self.skipped
+
+    @property
+    def ratio(self):
+        return self.skipped / self.total if self.total else 0.0
+
+    def check(self, rows):
+        """
+        Record the number of rows parsed and apply the policy.
+
+        Parameters:
+        - rows (int): Number of rows of the DataFrame read.
+
+        Raises:
+        - BadLinesError: If the share of skipped rows is above max_ratio.
+        """
+        self.rows = rows
+        if self.max_ratio is not None and self.ratio > self.max_ratio:
+            raise BadLinesError(f"{self.skipped} of {self.total} rows skipped ({self.ratio:.2%}), "
+                                f"more than {self.max_ratio:.2%} allowed", self)
+
+    def to_dict(self, path=None):
+        """
+        Return the report as a dict with the keys path, total_rows, rows, skipped_rows, ratio and samples.
+        """
+        return {
+            'path': path,
+            'total_rows': self.total,
+            'rows': self.rows,
+            'skipped_rows': self.skipped,
+            'ratio': self.ratio,
+            'samples': list(self.samples)
+        }
+
+    @classmethod
+    def from_dict(cls, report, max_ratio=0.01):
+        """
+        Build a report back from the dict returned by to_dict, e.g. for a file found in the prep cache.
+        """
+        bad_lines = cls(max_ratio, n_samples=max(len(report['samples']), 1))
+        bad_lines.rows = report['rows']
+        bad_lines.skipped = report['skipped_rows']
+        bad_lines.samples = list(report['samples'])
+        return bad_lines
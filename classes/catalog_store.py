@@ -0,0 +1,179 @@
+import pandas as pd
+import os
+import re
+from datetime import date
+
+class CatalogStore:
+    """
+    Class for storing daily snapshots of a source catalog as Parquet files and comparing them.
+
+    Snapshots keep typed columns (last_update is a timestamp, low cardinality columns are categories),
+    so they are much smaller and faster to load than the dated CSV files written by save_to_csv.
+
+    Attributes:
+    - name (str): Name of the catalog, used as the prefix of the snapshot files.
+    - folder (str): Folder where the snapshots are stored.
+    - key (str): Column identifying a resource across snapshots.
+
+    Methods:
+    - __init__(name, folder, key): Constructor method that initializes the store.
+    - snapshot_path(snapshot_date): Helper method to build the path of a snapshot.
+    - list_snapshots(): Lists the dates of the available snapshots.
+    - to_typed(df): Converts a catalog DataFrame to typed columns.
+    - save(df, snapshot_date): Saves a catalog as the snapshot of a given day.
+    - load(snapshot_date, columns): Loads a snapshot, the latest one by default.
+    - delta(df_new, df_old): Computes the resources added, removed and modified between two catalogs.
+    - load_delta(snapshot_date): Computes the delta between a snapshot and the previous one.
+    """
+
+    compared_columns = ['table_name', 'download_URL', 'data_format', 'last_update', 'dataset_id', 'dataset_name', 'frequency']
+    category_columns = ['data_format', 'dataset_id', 'dataset_name', 'frequency']
+
+    def __init__(self, name, folder='data/catalog', key='table_id'):
+        """
+        Initialize the CatalogStore object.
+
+        Parameters:
+        - name (str): Name of the catalog, used as the prefix of the snapshot files.
+        - folder (str): Folder where the snapshots are stored.
+        - key (str): Column identifying a resource across snapshots.
+        """
+        self.name = name
+        self.folder = folder
+        self.key = key
+
+    def snapshot_path(self, snapshot_date=None):
+        """
+        Build the path of the snapshot of a given day.
+
+        Parameters:
+        - snapshot_date (datetime.date or str): Day of the snapshot, today if None.
+
+        Returns:
+        - str: Path of the Parquet file.
+        """
+        if snapshot_date is None:
+            snapshot_date = date.today()
+        return f'{self.folder}/{self.name}_{snapshot_date}.parquet'
+
+    def list_snapshots(self):
+        """
+        List the dates of the available snapshots.
+
+        Returns:
+        - list: Dates of the snapshots as 'YYYY-MM-DD' strings, oldest first.
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        pattern = re.compile(re.escape(self.name) + r'_(\d{4}-\d{2}-\d{2})\.parquet$')
+        dates = [match.group(1) for match in map(pattern.match, os.listdir(self.folder)) if match]
+        return sorted(dates)
+
+    def to_typed(self, df):
+        """
+        Convert a catalog DataFrame to typed columns.
+
+        Parameters:
+        - df (pd.DataFrame): Catalog as returned by GetSourceCatalog.
+
+        Returns:
+        - pd.DataFrame: Catalog with a timestamp last_update and categorical low cardinality columns.
+        """
+        df = df.drop(columns=['index'], errors='ignore').copy()
+        if 'last_update' in df.columns:
+            df['last_update'] = pd.to_datetime(df['last_update'], format='ISO8601', errors='coerce')
+        for column in self.category_columns:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+        return df.reset_index(drop=True)
+
+    def save(self, df, snapshot_date=None):
+        """
+        Save a catalog as the snapshot of a given day.
+
+        Parameters:
+        - df (pd.DataFrame): Catalog to save.
+        - snapshot_date (datetime.date or str): Day of the snapshot, today if None.
+
+        Returns:
+        - str: Path of the Parquet file.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.snapshot_path(snapshot_date)
+        self.to_typed(df).to_parquet(path, index=False, compression='zstd')
+        print("Parquet file has been loaded to this path", path)
+        return path
+
+    def load(self, snapshot_date=None, columns=None):
+        """
+        Load a snapshot.
+
+        Parameters:
+        - snapshot_date (datetime.date or str): Day of the snapshot, the latest one if None.
+        - columns (list): Columns to load, all of them if None.
+
+        Returns:
+        - pd.DataFrame: Catalog of that day, or None if there is no snapshot.
+        """
+        if snapshot_date is None:
+            snapshots = self.list_snapshots()
+            if not snapshots:
+                return None
+            snapshot_date = snapshots[-1]
+        return pd.read_parquet(self.snapshot_path(snapshot_date), columns=columns)
+
+    def delta(self, df_new, df_old=None):
+        """
+        Compute the resources added, removed and modified between two catalogs.
+
+        Parameters:
+        - df_new (pd.DataFrame): Current catalog.
+        - df_old (pd.DataFrame): Previous catalog, every resource of df_new is added if None.
+
+        Returns:
+        - pd.DataFrame: Rows of df_new that were added or modified and rows of df_old that were removed,
+          with a 'change' column set to 'added', 'modified' or 'removed'.
+        """
+        df_new = self.to_typed(df_new).dropna(subset=[self.key]).drop_duplicates(subset=[self.key])
+        if df_old is None:
+            return df_new.assign(change='added')
+        df_old = self.to_typed(df_old).dropna(subset=[self.key]).drop_duplicates(subset=[self.key])
+
+        columns = [column for column in self.compared_columns if column in df_new.columns and column in df_old.columns]
+        old_values = df_old.set_index(self.key)[columns].astype(object)
+        new_values = df_new.set_index(self.key)[columns].astype(object)
+
+        added = ~df_new[self.key].isin(old_values.index)
+        removed = ~df_old[self.key].isin(new_values.index)
+        common = new_values.index.intersection(old_values.index)
+        left = new_values.loc[common]
+        right = old_values.loc[common]
+        changed = ((left != right) & ~(left.isna() & right.isna())).any(axis=1)
+        modified = df_new[self.key].isin(changed[changed].index)
+
+        delta = pd.concat([
+            df_new[added].assign(change='added'),
+            df_new[modified].assign(change='modified'),
+            df_old[removed].assign(change='removed')
+        ], ignore_index=True)
+        return delta
+
+    def load_delta(self, snapshot_date=None):
+        """
+        Compute the delta between a snapshot and the snapshot preceding it.
+
+        Parameters:
+        - snapshot_date (datetime.date or str): Day of the snapshot, the latest one if None.
+
+        Returns:
+        - pd.DataFrame: Delta as returned by delta(), or None if there is no snapshot. DlCatalogContent
+          downloads its added and modified rows and leaves out the removed ones.
+        """
+        snapshots = self.list_snapshots()
+        if snapshot_date is None:
+            if not snapshots:
+                return None
+            snapshot_date = snapshots[-1]
+        previous = [snapshot for snapshot in snapshots if snapshot < str(snapshot_date)]
+        df_old = self.load(previous[-1]) if previous else None
+        return self.delta(self.load(snapshot_date), df_old)
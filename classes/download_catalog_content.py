@@ -3,6 +3,14 @@ import os
 import requests
 from datetime import datetime
 import shutil
+import json
+import zipfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from classes.stream_download import StreamDownloader
 
 class DlCatalogContent:
     """
@@ -12,21 +20,41 @@ class DlCatalogContent:
     - df_catalog (pd.DataFrame): DataFrame containing the catalog information.
 
     Methods:
-    - __init__(catalog_path): Constructor method that initializes the object with the provided catalog path.
+    - __init__(catalog_path): Constructor method that initializes the object with the provided catalog path or DataFrame.
     - reorganize_file_name(file_name, last_date): Helper method to create a new filename with versioning based on the last update date.
     - extract_date(date_str): Helper method to extract and convert date strings to datetime objects.
-    - get_tables(): Downloads and organizes datasets based on the information in the catalog.
+    - create_session(pool_size): Helper method to create a pooled HTTP session shared by the download workers.
+    - host_semaphore(url): Helper method to limit the number of parallel requests per host.
+    - destination_path(row): Helper method to build the local path of a catalog row.
+    - load_manifest(manifest_path): Helper method to load the download manifest.
+    - save_manifest(manifest_path): Helper method to save the download manifest.
+    - conditional_headers(entry): Helper method to build the headers of a conditional request.
+    - add_to_archive(path): Helper method to write a downloaded file into the output archive.
+    - download_table(row): Downloads a single catalog row and returns its result.
+    - get_tables(concurrent, max_workers, max_per_host, timeout, chunk_size, manifest_path, archive_path, compresslevel): Downloads and organizes datasets based on the information in the catalog.
     - zip_files(): Zips all the downloaded files into a single archive.
     """
 
+    # formats that are already compressed, deflating them again costs CPU for nothing
+    stored_extensions = ('.xlsx', '.xls', '.docx', '.zip', '.gz', '.bz2', '.7z', '.pdf', '.png', '.jpg', '.parquet')
+
     def __init__(self, catalog_path):
         """
         Initialize the DlCatalogContent object.
 
         Parameters:
-        - catalog_path (str): Path to the CSV file containing the dataset catalog.
+        - catalog_path (str or pd.DataFrame): Path to the CSV or Parquet file containing the dataset catalog,
+          or the catalog itself, e.g. the delta returned by CatalogStore.load_delta(). The rows of a delta
+          whose 'change' is 'removed' are left out, since these resources aren't in the catalog anymore.
         """
-        self.df_catalog = pd.read_csv(catalog_path)
+        if isinstance(catalog_path, pd.DataFrame):
+            self.df_catalog = catalog_path
+        elif catalog_path.endswith('.parquet'):
+            self.df_catalog = pd.read_parquet(catalog_path)
+        else:
+            self.df_catalog = pd.read_csv(catalog_path)
+        if 'change' in self.df_catalog.columns:
+            self.df_catalog = self.df_catalog[self.df_catalog['change'] != 'removed'].reset_index(drop=True)
 
     def reorganize_file_name(self, file_name, last_date):
         """
@@ -48,47 +76,281 @@ class DlCatalogContent:
         Extract and convert date strings to datetime objects.
 
         Parameters:
-        - date_str (str): Date string in the format '%Y-%m-%dT%H:%M:%S.%f' or '%Y-%m-%dT%H:%M:%S'.
+        - date_str (str or datetime): Date string in the format '%Y-%m-%dT%H:%M:%S.%f' or '%Y-%m-%dT%H:%M:%S',
+          or a timestamp already parsed, as in the Parquet catalog snapshots.
 
         Returns:
         - datetime.date: Date extracted from the date string.
         """
+        if isinstance(date_str, datetime):
+            return date_str.date()
         try:
             timestamp_obj = datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%f')
         except:
             timestamp_obj = datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S')
         return timestamp_obj.date()
 
-    def get_tables(self):
+    def create_session(self, pool_size):
         """
-        Download and organize datasets based on the information in the catalog.
+        Create a pooled HTTP session shared by all the download workers.
+
+        Parameters:
+        - pool_size (int): Number of connections kept alive per host.
+
+        Returns:
+        - requests.Session: Session with a connection pool sized for the workers.
         """
-        for index, row in self.df_catalog.iterrows():
-            if row.download_URL is not None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
-                if row.dataset_name is not None:
-                    dest_folder = f'data/raw_datasets/{row.dataset_name}'
-                    os.makedirs(dest_folder, exist_ok=True)
-                else:
-                    dest_folder = 'data/raw_datasets/unknown'
-                    os.makedirs(dest_folder, exist_ok=True)
+    def host_semaphore(self, url):
+        """
+        Return the semaphore limiting the number of parallel requests to the host of a URL.
+
+        Parameters:
+        - url (str): URL to be requested.
 
-                if row.last_update is not None:
-                    last_date = row.last_update
-                    last_date = self.extract_date(last_date)
+        Returns:
+        - threading.Semaphore: Semaphore shared by every request to the same host.
+        """
+        host = urlparse(url).netloc
+        with self.host_lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.Semaphore(self.max_per_host)
+            return self.host_semaphores[host]
+
+    def destination_path(self, row):
+        """
+        Build the local path where a catalog row is downloaded, creating its folder.
+
+        Parameters:
+        - row (pd.Series): Catalog row.
+
+        Returns:
+        - str: Path of the versioned file in data/raw_datasets.
+        """
+        if pd.notna(row.dataset_name):
+            dest_folder = f'data/raw_datasets/{row.dataset_name}'
+        else:
+            dest_folder = 'data/raw_datasets/unknown'
+        os.makedirs(dest_folder, exist_ok=True)
+
+        if pd.notna(row.last_update):
+            last_date = self.extract_date(row.last_update)
+        else:
+            last_date = datetime.now().date()
+
+        new_file_name = self.reorganize_file_name(row.table_name, last_date)
+        return f'{dest_folder}/{new_file_name}'
+
+    def load_manifest(self, manifest_path):
+        """
+        Load the download manifest, which keeps the ETag, Last-Modified, size and hash of each download_URL.
+
+        Parameters:
+        - manifest_path (str): Path of the JSON manifest.
+
+        Returns:
+        - dict: Manifest entries keyed by download_URL, empty if the file doesn't exist.
+        """
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest_path):
+        """
+        Save the download manifest, replacing the previous one only once it is fully written.
+
+        Parameters:
+        - manifest_path (str): Path of the JSON manifest.
+        """
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def conditional_headers(self, entry):
+        """
+        Build the headers of a conditional request from a manifest entry.
+
+        Parameters:
+        - entry (dict): Manifest entry of the download_URL, or None.
+
+        Returns:
+        - dict: If-None-Match / If-Modified-Since headers, empty if there is nothing to compare with.
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def add_to_archive(self, path):
+        """
+        Write a downloaded file into the output archive, if get_tables was asked to build one.
+
+        Already compressed formats are stored as they are, the other files are deflated.
+
+        Parameters:
+        - path (str): Path of the file in data/raw_datasets.
+        """
+        if self.archive is None:
+            return
+        arcname = os.path.relpath(path, 'data/raw_datasets')
+        if os.path.splitext(path)[1].lower() in self.stored_extensions:
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+        with self.archive_lock:
+            self.archive.write(path, arcname, compress_type=compress_type, compresslevel=self.compresslevel)
+
+    def download_table(self, row):
+        """
+        Download a single catalog row and report how it went.
+
+        Parameters:
+        - row (pd.Series): Catalog row.
+
+        Returns:
+        - dict: Result with table_name, download_URL, path, status, http_status, bytes, sha256, duration and error.
+        """
+        result = {
+            'table_name': row.table_name,
+            'download_URL': row.download_URL,
+            'path': None,
+            'status': 'skipped',
+            'http_status': None,
+            'bytes': 0,
+            'sha256': None,
+            'duration': 0.0,
+            'error': None
+        }
+        if pd.isna(row.download_URL):
+            result['error'] = 'no download URL'
+            return result
+
+        start = time.perf_counter()
+        try:
+            path = self.destination_path(row)
+            result['path'] = path
+            last_update = row.last_update if pd.notna(row.last_update) else None
+            if isinstance(last_update, datetime):
+                last_update = last_update.isoformat()
+            entry = self.manifest.get(row.download_URL)
+            if entry is not None and not os.path.exists(entry['path']):
+                entry = None
+
+            if entry is not None and last_update is not None and entry['last_update'] == last_update and entry['path'] == path:
+                result['bytes'] = entry['size']
+                result['sha256'] = entry['sha256']
+                result['status'] = 'cached'
+                self.add_to_archive(path)
+            else:
+                headers = self.conditional_headers(entry)
+                with self.host_semaphore(row.download_URL):
+                    download = self.downloader.download(row.download_URL, path, headers=headers)
+                result['http_status'] = download['http_status']
+                if download['http_status'] == 304:
+                    if entry is None:
+                        # no conditional header was sent (a proxy may still answer 304), there is no local copy to keep
+                        raise IOError(f"304 Not Modified without a previous download of {row.download_URL}")
+                    if entry['path'] != path:
+                        shutil.copyfile(entry['path'], path)
+                    download.update({
+                        'bytes': entry['size'],
+                        'sha256': entry['sha256'],
+                        'etag': download['etag'] or entry['etag'],
+                        'last_modified': download['last_modified'] or entry['last_modified']
+                    })
+                    result['status'] = 'not modified'
                 else:
-                    current_datetime = datetime.now()
-                    last_date = current_datetime.date()
-
-                try:
-                    response = requests.get(row.download_URL)
-                    new_file_name = self.reorganize_file_name(row.table_name, last_date)
-
-                    with open(f'{dest_folder}/{new_file_name}', 'wb') as f:
-                        f.write(response.content)
-                except Exception as e:
-                    print(f"Error when downloading table {row.table_name} : {e}")
-                    continue
+                    result['status'] = 'downloaded'
+                result['bytes'] = download['bytes']
+                result['sha256'] = download['sha256']
+                self.add_to_archive(path)
+                with self.manifest_lock:
+                    self.manifest[row.download_URL] = {
+                        'path': path,
+                        'last_update': last_update,
+                        'etag': download['etag'],
+                        'last_modified': download['last_modified'],
+                        'size': download['bytes'],
+                        'sha256': download['sha256']
+                    }
+        except Exception as e:
+            if isinstance(e, requests.HTTPError):
+                result['http_status'] = e.response.status_code
+            print(f"Error when downloading table {row.table_name} : {e}")
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['duration'] = time.perf_counter() - start
+        return result
+
+    def get_tables(self, concurrent=False, max_workers=8, max_per_host=4, timeout=300, chunk_size=1024 * 1024,
+                   manifest_path='data/download_manifest.json', archive_path=None, compresslevel=6):
+        """
+        Download and organize datasets based on the information in the catalog.
+
+        Files are streamed to disk in chunks, an interrupted download is resumed on the next call.
+        Tables whose last_update hasn't changed since the previous download are skipped, the others
+        are requested with If-None-Match / If-Modified-Since so the server can answer 304.
+        With archive_path, each file is added to the archive as soon as it is on disk, so compression
+        overlaps with the downloads still running and zip_files() isn't needed afterwards.
+
+        Parameters:
+        - concurrent (bool): Download the tables with a pool of threads instead of one after another.
+        - max_workers (int): Maximum number of downloads running at the same time.
+        - max_per_host (int): Maximum number of downloads running at the same time against one host.
+        - timeout (int): Timeout in seconds of each HTTP request.
+        - chunk_size (int): Size in bytes of the chunks written to disk.
+        - manifest_path (str): Path of the download manifest, every table is downloaded again if None.
+        - archive_path (str): Path of the zip archive built during the downloads, e.g. 'data/raw_datasets.zip'.
+          It only contains the files of this catalog, not older versions left in data/raw_datasets.
+        - compresslevel (int): Deflate level of the archive, from 0 (fastest) to 9 (smallest).
+
+        Returns:
+        - pd.DataFrame: One row per table with its status, bytes, duration and error.
+        """
+        if not concurrent:
+            max_workers = 1
+        self.max_per_host = max_per_host
+        self.host_semaphores = {}
+        self.host_lock = threading.Lock()
+        self.session = self.create_session(max_workers)
+        self.downloader = StreamDownloader(self.session, chunk_size=chunk_size, timeout=timeout)
+        self.manifest = self.load_manifest(manifest_path) if manifest_path is not None else {}
+        self.manifest_lock = threading.Lock()
+        self.archive = None
+        self.archive_lock = threading.Lock()
+        self.compresslevel = compresslevel
+        if archive_path is not None:
+            os.makedirs(os.path.dirname(archive_path) or '.', exist_ok=True)
+            self.archive = zipfile.ZipFile(archive_path + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED)
+
+        rows = [row for index, row in self.df_catalog.iterrows()]
+        try:
+            if concurrent:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = list(executor.map(self.download_table, rows))
+            else:
+                results = [self.download_table(row) for row in rows]
+        finally:
+            self.session.close()
+            if manifest_path is not None:
+                self.save_manifest(manifest_path)
+            if self.archive is not None:
+                self.archive.close()
+                os.replace(archive_path + '.tmp', archive_path)
+                print(f"All downloaded files have been zipped into {archive_path}")
+
+        self.df_results = pd.DataFrame(results)
+        return self.df_results
     
     def zip_files(self):
         """
@@ -0,0 +1,215 @@
+import pandas as pd
+import numpy as np
+
+class DtypeInferer:
+    """
+    Class for giving compact dtypes to the columns of a prepped DataFrame, and the BigQuery schema matching them.
+
+    The kind of each column is detected from all its values: a conversion is only applied when every non null
+    value matches it, so no value is lost. Text columns are recognized as
+    - integers and floats, French formats included ('1 234,5', '1.234,5'), but not codes with leading zeros
+      nor integers too large for int64 (e.g. 20 digit IDs), which are kept as text;
+    - dates and datetimes, as 'DD/MM/YYYY' or ISO 8601;
+    - booleans, as oui/non, vrai/faux, true/false or yes/no;
+    - categories, when they have few distinct values.
+    Float columns holding only whole numbers become nullable integers.
+
+    Attributes:
+    - max_categories (int): Maximum number of distinct values of a categorical column.
+    - max_category_ratio (float): Maximum ratio of distinct values to values of a categorical column.
+    - min_category_rows (int): Minimum number of values of a categorical column.
+
+    Methods:
+    - __init__(max_categories, max_category_ratio, min_category_rows): Constructor method that initializes the object.
+    - detect(series): Detects the kind of a column.
+    - merge(kind, other): Kind of a column from the kinds of two of its chunks.
+    - convert(series, kind): Converts a column to its kind.
+    - infer(df): Detects and converts every column of a DataFrame.
+    - schema(columns, kinds): BigQuery schema of the columns.
+    - read_options(schema): Options of pd.read_csv reading a CSV file with its schema.
+    """
+
+    bq_types = {'int': 'INTEGER', 'float': 'FLOAT', 'bool': 'BOOLEAN', 'date': 'DATE', 'datetime': 'DATETIME',
+                'category': 'STRING', 'string': 'STRING', 'empty': 'STRING'}
+    booleans = {'oui': True, 'non': False, 'vrai': True, 'faux': False, 'true': True, 'false': False, 'yes': True, 'no': False}
+    date_formats = [
+        ('date', r'\d{1,2}/\d{1,2}/\d{4}', '%d/%m/%Y'),
+        ('date', r'\d{4}-\d{2}-\d{2}', '%Y-%m-%d'),
+        ('datetime', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}(?::\d{2})?', None),
+        ('datetime', r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?', 'ISO8601'),
+    ]
+    integer_pattern = r'[-+]?(?:0|[1-9]\d*)'
+    int64_min, int64_max = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+    # the decimal separator is chosen for the whole column: 1234.5, or 1234,5 and 1.234,5
+    float_pattern = r'[-+]?(?:0|[1-9]\d*)?\.\d+'
+    french_float_pattern = r'[-+]?(?:[1-9]\d{0,2}(?:\.\d{3})+|0|[1-9]\d*)(?:,\d+)?'
+
+    def __init__(self, max_categories=50, max_category_ratio=0.5, min_category_rows=20):
+        """
+        Initialize the DtypeInferer object.
+
+        Parameters:
+        - max_categories (int): Maximum number of distinct values of a categorical column.
+        - max_category_ratio (float): Maximum ratio of distinct values to values of a categorical column.
+        - min_category_rows (int): Minimum number of values of a categorical column.
+        """
+        self.max_categories = max_categories
+        self.max_category_ratio = max_category_ratio
+        self.min_category_rows = min_category_rows
+
+    def text_values(self, series):
+        # non null values as stripped text, without the spaces grouping the thousands
+        values = series.dropna().astype(str).str.strip()
+        return values.str.replace(r'(?<=\d)[ \u00a0\u202f](?=\d{3}(?!\d))', '', regex=True)
+
+    def fits_int64(self, values):
+        """
+        Check that integers, as text matching integer_pattern or as numbers, all fit in int64.
+        """
+        if pd.api.types.is_numeric_dtype(values):
+            return values.empty or (self.int64_min <= values.min() and values.max() <= self.int64_max)
+        # up to 18 digits always fit, longer values are checked one by one
+        long_values = values[values.str.lstrip('+-').str.len() >= 19]
+        return all(self.int64_min <= int(value) <= self.int64_max for value in long_values)
+
+    def number_kind(self, values):
+        """
+        'int' if numbers without nulls are all whole and fit in int64, e.g. 60.0 written by Excel, 'float' otherwise.
+        """
+        whole = np.isfinite(values).all() and (values == np.floor(values)).all()
+        return 'int' if whole and self.fits_int64(values) else 'float'
+
+    def detect(self, series):
+        """
+        Detect the kind of a column.
+
+        Parameters:
+        - series (pd.Series): Column of a DataFrame.
+
+        Returns:
+        - str: 'int', 'float', 'bool', 'date', 'datetime', 'category', 'string' (kept as it is) or 'empty'.
+        """
+        if series.notna().sum() == 0:
+            return 'empty'
+        if pd.api.types.is_bool_dtype(series):
+            return 'bool'
+        if pd.api.types.is_integer_dtype(series):
+            # uint64 columns may hold integers too large for int64
+            return 'int' if self.fits_int64(series.dropna()) else 'string'
+        if pd.api.types.is_float_dtype(series):
+            return self.number_kind(series.dropna())
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return 'datetime'
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            return 'string'
+
+        values = self.text_values(series)
+        if values.str.fullmatch(self.integer_pattern).all():
+            # integers too large for int64 are IDs rather than quantities, they would lose digits as floats
+            return 'int' if self.fits_int64(values) else 'string'
+        if values.str.fullmatch(self.integer_pattern + '|' + self.float_pattern).all():
+            return self.number_kind(pd.to_numeric(values))
+        if values.str.fullmatch(self.french_float_pattern).all():
+            return self.number_kind(pd.to_numeric(values.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)))
+        if values.str.lower().isin(self.booleans.keys()).all():
+            return 'bool'
+        for kind, pattern, date_format in self.date_formats:
+            if values.str.fullmatch(pattern).all():
+                parsed = pd.to_datetime(values, format=date_format, dayfirst=date_format is None, errors='coerce')
+                if parsed.notna().all():
+                    return kind
+        n_unique = values.nunique()
+        if len(values) >= self.min_category_rows and n_unique <= self.max_categories \
+                and n_unique <= self.max_category_ratio * len(values):
+            return 'category'
+        return 'string'
+
+    def merge(self, kind, other):
+        """
+        Kind of a column read in chunks, from the kind of the previous chunks and the kind of a new one.
+        """
+        if kind is None or kind == 'empty':
+            return other
+        if other == 'empty' or kind == other:
+            return kind
+        if {kind, other} == {'int', 'float'}:
+            return 'float'
+        return 'string'
+
+    def convert(self, series, kind):
+        """
+        Convert a column to its kind.
+
+        Parameters:
+        - series (pd.Series): Column of a DataFrame.
+        - kind (str): Kind returned by detect or merge.
+
+        Returns:
+        - pd.Series: Converted column, the same column for 'string' and 'empty'.
+        """
+        if kind == 'string' and pd.api.types.is_integer_dtype(series):
+            # integers too large for int64, written as text to match the STRING type of the schema
+            return series.map(str, na_action='ignore').astype(object)
+        if kind in ('string', 'empty'):
+            return series
+        if kind == 'category':
+            # columns read from xlsx may mix numbers and text, categories are text like their STRING type
+            return series.map(str, na_action='ignore').astype('category')
+        if kind == 'bool':
+            if pd.api.types.is_bool_dtype(series):
+                return series.astype('boolean')
+            return series.astype(str).str.strip().str.lower().map(self.booleans).where(series.notna()).astype('boolean')
+        if kind == 'datetime' and pd.api.types.is_datetime64_any_dtype(series):
+            return series
+
+        values = series.where(series.isna(), self.text_values(series)) if not pd.api.types.is_numeric_dtype(series) else series
+        if kind in ('date', 'datetime'):
+            for pattern_kind, pattern, date_format in self.date_formats:
+                if pattern_kind == kind and values.dropna().str.fullmatch(pattern).all():
+                    return pd.to_datetime(values, format=date_format, dayfirst=date_format is None)
+            raise ValueError(f"column {series.name} doesn't hold {kind} values")
+        if not pd.api.types.is_numeric_dtype(values):
+            if not values.dropna().str.fullmatch(self.integer_pattern + '|' + self.float_pattern).all():
+                values = values.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+            values = pd.to_numeric(values)
+        if kind == 'int':
+            return values.astype('Int64')
+        return values.astype('float64')
+
+    def infer(self, df):
+        """
+        Detect and convert every column of a DataFrame.
+
+        Parameters:
+        - df (pd.DataFrame): Prepped DataFrame.
+
+        Returns:
+        - tuple: (DataFrame with converted columns, dict of the kind of each column).
+        """
+        kinds = {column: self.detect(df.iloc[:, index]) for index, column in enumerate(df.columns)}
+        df = df.copy()
+        for index, column in enumerate(df.columns):
+            df.isetitem(index, self.convert(df.iloc[:, index], kinds[column]))
+        return df, kinds
+
+    def schema(self, columns, kinds):
+        """
+        BigQuery schema of the columns, as a list of {'name', 'type'} dicts (the JSON schema format of BigQuery).
+        """
+        return [{'name': column, 'type': self.bq_types[kinds[column]], 'mode': 'NULLABLE'} for column in columns]
+
+    def read_options(self, schema):
+        """
+        Options of pd.read_csv reading a prepped CSV file with the dtypes of its schema.
+
+        Parameters:
+        - schema (list): Schema returned by schema().
+
+        Returns:
+        - dict: dtype and parse_dates options.
+        """
+        dtypes = {'INTEGER': 'Int64', 'FLOAT': 'float64', 'BOOLEAN': 'boolean', 'STRING': str}
+        return {
+            'dtype': {field['name']: dtypes[field['type']] for field in schema if field['type'] in dtypes},
+            'parse_dates': [field['name'] for field in schema if field['type'] in ('DATE', 'DATETIME')]
+        }
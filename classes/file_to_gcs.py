@@ -13,6 +13,13 @@ import zipfile
 import gzip
 from datetime import date
 import os
+import time
+import mimetypes
+from requests.adapters import HTTPAdapter
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.storage import transfer_manager
+from classes.stream_download import StreamDownloader
 
 class FromFileToGCS:
     """
@@ -32,22 +39,28 @@ class FromFileToGCS:
         service account credentials, which are used for authentication
     storage_client : google.cloud.storage.client.Client
         the client for interacting with the GCS API
+    bucket : google.cloud.storage.bucket.Bucket
+        handle of the bucket, shared by all the uploads
 
     Methods
     -------
     create_bucket():
         Creates a new bucket in GCS
-    download_and_upload_from_URL(url, destination_blob_name):
-        Downloads data from a URL and uploads it to GCS
-    local_to_gcs(file_path, destination_blob_name):
-        Uploads a local file to GCS
+    download_and_upload_from_URLs(urls, dest_folder, dest_blob, stream, max_workers, chunk_size, download_dir):
+        Downloads data from URLs and uploads it to GCS, streamed and concurrently if asked, and returns a summary
+    stream_url_to_gcs(downloader, url, destination_blob_name_raw, chunk_size):
+        Streams the body of a URL into a chunked upload, without a local copy
+    local_to_gcs(file_paths, dest_folder, dest_blob, max_workers, large_file_size, chunk_size, chunk_workers):
+        Uploads local files to GCS, concurrently if max_workers is set, and returns a summary
+    upload_file(file_path, destination_blob_name_raw, ...):
+        Uploads a single local file or file object to GCS
     list_blobs():
         Extracts data from a compressed file and uploads it to GCS
     extract_and_upload_sel(blobs):
         Extracts data from a compressed file and uploads it to GCS
     """
 
-    def __init__(self, bucket_name, credentials_path):
+    def __init__(self, bucket_name, credentials_path, storage_client=None):
         """
         Constructs all the necessary attributes for the DataProcessor object.
 
@@ -56,11 +69,17 @@ class FromFileToGCS:
             bucket_name : str
                 name of the GCS bucket
             credentials_path : str
-                path of the service account credentials file
+                path of the service account credentials file, unused when storage_client is given
+            storage_client : google.cloud.storage.client.Client
+                client to use instead of creating one, e.g. benchmarks.fake_clients.FakeStorageClient
         """
         self.bucket_name = bucket_name
-        self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        self.storage_client = storage.Client(credentials=self.credentials)
+        if storage_client is None:
+            self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
+            storage_client = storage.Client(credentials=self.credentials)
+        self.storage_client = storage_client
+        # building a bucket handle doesn't call the API, the same one is used by every upload
+        self.bucket = self.storage_client.bucket(self.bucket_name)
 
     def create_bucket(self):
         """
@@ -78,7 +97,41 @@ class FromFileToGCS:
             new_bucket = self.storage_client.create_bucket(bucket, location="europe-west1")
             print('A new bucket created at {}'.format(new_bucket.name))
 
-    def download_and_upload_from_URLs(self, urls, dest_folder, dest_blob=None):
+    def content_type(self, content_type, name):
+        # Content-Type of the response, or guessed from the name of the file when the server doesn't send one
+        if content_type:
+            return content_type
+        return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def stream_url_to_gcs(self, downloader, url, destination_blob_name_raw, chunk_size=8 * 1024 * 1024):
+        """
+        Streams the body of a URL into a chunked resumable upload, without writing it to disk. At most about
+        chunk_size bytes are held in memory, whatever the size of the file, and a body shorter than its
+        Content-Length cancels the upload instead of creating a truncated blob.
+
+        Parameters
+        ----------
+            downloader : StreamDownloader
+                downloader holding the HTTP session
+            url : str
+                URL of the data
+            destination_blob_name_raw : str
+                name of the blob
+            chunk_size : int
+                size in bytes of the chunks of the upload, a multiple of 256 KB
+
+        Returns
+        -------
+            dict
+                result of the download, see StreamDownloader.result
+        """
+        blob = self.bucket.blob(destination_blob_name_raw)
+        open_blob = lambda content_type: blob.open('wb', chunk_size=chunk_size,
+                                                   content_type=self.content_type(content_type, destination_blob_name_raw))
+        return downloader.download_to(url, open_blob)
+
+    def download_and_upload_from_URLs(self, urls, dest_folder, dest_blob=None, stream=False, max_workers=None,
+                                      chunk_size=8 * 1024 * 1024, download_dir=None):
         """
         Downloads data from multiple URLs and uploads them to GCS.
 
@@ -88,94 +141,205 @@ class FromFileToGCS:
                 URLs of the data to be downloaded
             dest_folder : str
                 name of the folder inside the bucket where the data will be uploaded in GCS
+            dest_blob : list of str
+                names of the blobs, the basename of each URL is used if None
+            stream : bool
+                if True, each body is piped into a chunked upload (see stream_url_to_gcs) instead of being
+                downloaded to a temporary file first
+            max_workers : int
+                number of URLs transferred at the same time, one after another if None
+            chunk_size : int
+                size in bytes of the chunks of the streamed uploads, a multiple of 256 KB
+            download_dir : str
+                folder where the files are downloaded before their upload, as '<dest_folder>/<blob name>'. A
+                download interrupted by a failure is kept there as a '.part' file and resumed by the next call
+                with the same download_dir. A temporary folder removed at the end of the call is used if None,
+                so nothing is resumed
+
+        Each file is streamed to a file on disk, or to GCS directly with stream, so the memory used doesn't
+        depend on its size. The content type of each blob is the Content-Type of its response.
+
+        Returns
+        -------
+            list of dict
+                result of each URL in the order of urls: url, blob, bytes, content_type, seconds, and error
+                (None if the file was uploaded). A failed transfer doesn't stop the others
         """
 
         today = str(date.today()) + "/"
         dest_folder = dest_folder + "/"
         if dest_blob is None:
-            for url in urls:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    file_stream = BytesIO(response.content)
-                    file_name = os.path.basename(url)
-                    destination_blob_name_raw = today + dest_folder + file_name
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob = bucket.blob(destination_blob_name_raw)
-                    blob.upload_from_file(file_stream, content_type='application/zip')
-                    print(f"{Fore.GREEN}Raw file {file_name} downloaded and uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
+            dest_blob = [os.path.basename(url) for url in urls]
+
+        session = requests.Session()
+        if max_workers is not None:
+            # one connection per worker is kept alive for each host
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        downloader = StreamDownloader(session=session)
+
+        def transfer(url, destination_blob_name, temp_path):
+            destination_blob_name_raw = today + dest_folder + destination_blob_name
+            start = time.perf_counter()
+            try:
+                if stream:
+                    result = self.stream_url_to_gcs(downloader, url, destination_blob_name_raw, chunk_size)
                 else:
-                    print(f"{Fore.RED}Request for {url} failed with error {response.status_code}.{Style.RESET_ALL}")
+                    # the body is streamed to disk instead of being held in memory
+                    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+                    result = downloader.download(url, temp_path)
+                    blob = self.bucket.blob(destination_blob_name_raw)
+                    blob.upload_from_filename(temp_path, content_type=self.content_type(result['content_type'], destination_blob_name),
+                                              timeout=300)
+                    os.remove(temp_path)
+            except Exception as e:
+                print(f"{Fore.RED}Transfer of {url} failed with error {e}.{Style.RESET_ALL}")
+                return {'url': url, 'blob': destination_blob_name_raw, 'bytes': None, 'content_type': None,
+                        'seconds': None, 'error': f"{type(e).__name__}: {e}"}
+            print(f"{Fore.GREEN}Raw file {destination_blob_name} downloaded and uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
+            return {'url': url, 'blob': destination_blob_name_raw, 'bytes': result['bytes'],
+                    'content_type': self.content_type(result['content_type'], destination_blob_name),
+                    'seconds': time.perf_counter() - start, 'error': None}
+
+        temp_dir = None
+        if download_dir is None:
+            temp_dir = tempfile.TemporaryDirectory()
+            # each transfer of a worker has its own temporary file, named after its blob
+            temp_paths = [os.path.join(temp_dir.name, str(index), os.path.basename(name)) for index, name in enumerate(dest_blob)]
         else:
-            for url, destination_blob_name in zip(urls, dest_blob):
-                response = requests.get(url)
-                if response.status_code == 200:
-                    file_stream = BytesIO(response.content)
-                    destination_blob_name_raw = today + dest_folder + destination_blob_name
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob = bucket.blob(destination_blob_name_raw)
-                    blob.upload_from_file(file_stream, content_type='application/zip')
-                    print(f"{Fore.GREEN}Raw file {destination_blob_name} downloaded and uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
-                else:
-                    print(f"{Fore.RED}Request for {url} failed with error {response.status_code}.{Style.RESET_ALL}")
+            # the same path for the same blob from one call to the next, so its partial download can be resumed
+            temp_paths = [os.path.join(download_dir, dest_folder, name) for name in dest_blob]
+        try:
+            transfers = list(zip(urls, dest_blob, temp_paths))
+            if max_workers is None:
+                results = [transfer(*arguments) for arguments in transfers]
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = list(executor.map(lambda arguments: transfer(*arguments), transfers))
+        finally:
+            if temp_dir is not None:
+                temp_dir.cleanup()
+        failed = sum(result['error'] is not None for result in results)
+        print(f"{len(results) - failed} of {len(results)} files transferred to GCS.")
+        return results
 
-    def local_to_gcs(self, file_paths, dest_folder, dest_blob=None):
+    def source_name(self, file_path):
+        # name of a local file in the upload summary, file objects without a name are named after their type
+        if type(file_path) == str:
+            return file_path
+        return getattr(file_path, 'name', None) or type(file_path).__name__
+
+    def upload_file(self, file_path, destination_blob_name_raw, csv_from_file=False, large_file_size=None,
+                    chunk_size=32 * 1024 * 1024, chunk_workers=None):
+        """
+        Uploads a single local file or file object to GCS.
+
+        Parameters
+        ----------
+            file_path : str or file object
+                path of the local file, or binary file object (e.g. the archive returned by process_zip_file)
+            destination_blob_name_raw : str
+                name of the blob
+            csv_from_file : bool
+                if True, the file object is read as a CSV separated by ';' and uploaded separated by ','
+            large_file_size : int
+                size in bytes above which a local file is uploaded in chunks of chunk_size, never if None
+            chunk_size : int
+                size in bytes of the chunks of the large files, a multiple of 256 KB
+            chunk_workers : int
+                if set, the chunks of a large file are uploaded concurrently by this many threads
+                (XML multipart upload), else one after another (resumable upload)
+
+        Returns
+        -------
+            dict
+                source, blob, size in bytes (None for file objects) and seconds of the upload
+        """
+        start = time.perf_counter()
+        size = None
+        if hasattr(file_path, 'read'):
+            if csv_from_file:
+                data = pd.read_csv(file_path, sep=';')
+                blob = self.bucket.blob(destination_blob_name_raw)
+                blob.upload_from_string(data.to_csv(index=False), content_type='text/csv')
+            else:
+                blob = self.bucket.blob(destination_blob_name_raw)
+                blob.upload_from_file(file_path, content_type='application/zip')
+        else:
+            size = os.path.getsize(file_path)
+            if large_file_size is not None and size >= large_file_size and chunk_workers is not None:
+                blob = self.bucket.blob(destination_blob_name_raw)
+                transfer_manager.upload_chunks_concurrently(file_path, blob, chunk_size=chunk_size, max_workers=chunk_workers,
+                                                            worker_type=transfer_manager.THREAD)
+            elif large_file_size is not None and size >= large_file_size:
+                blob = self.bucket.blob(destination_blob_name_raw, chunk_size=chunk_size)
+                blob.upload_from_filename(file_path, timeout=300)
+            else:
+                blob = self.bucket.blob(destination_blob_name_raw)
+                blob.upload_from_filename(file_path, timeout=300)
+        return {'source': self.source_name(file_path), 'blob': destination_blob_name_raw, 'size': size, 'seconds': time.perf_counter() - start}
+
+    def local_to_gcs(self, file_paths, dest_folder, dest_blob=None, max_workers=None, large_file_size=None,
+                     chunk_size=32 * 1024 * 1024, chunk_workers=None):
         """
             Uploads multiple local files to GCS.
 
             Parameters
             ----------
                 file_paths : list of str
-                    paths of the local files to be uploaded
+                    paths of the local files to be uploaded, or binary file objects
                 dest_folder : str
                     name of the folder inside the bucket where the data will be uploaded in GCS
+                dest_blob : list of str
+                    names of the blobs, the basename of each path is used if None ('prep_datasets.zip' for
+                    file objects). With dest_blob, file objects are read as CSV separated by ';' and
+                    uploaded separated by ','
+                max_workers : int
+                    number of files uploaded at the same time, one after another if None
+                large_file_size, chunk_size, chunk_workers :
+                    upload of the large files in chunks, see upload_file
+
+            Returns
+            -------
+                list of dict
+                    result of each file in the order of file_paths: source, blob, size, seconds, and
+                    error (None if the file was uploaded). A failed upload doesn't stop the others
             """
         today = str(date.today()) + "/"
         dest_folder = dest_folder + "/"
 
+        uploads = []
         if dest_blob is None:
             for file_path in file_paths:
-                print(file_path)
                 if type(file_path) == str:
-                    file_name = os.path.basename(file_path)
-                    destination_blob_name_raw = today + dest_folder + file_name
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob = bucket.blob(destination_blob_name_raw)
-                    blob.upload_from_filename(file_path, timeout=300)
-                    print(f"{Fore.GREEN} file {file_name} uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
-                if type(file_path) == io.BytesIO or type(file_path) == io.StringIO:
-                    file_name = 'prep_datasets.zip'
-                    destination_blob_name_raw = today + dest_folder + file_name
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob = bucket.blob(destination_blob_name_raw)
-                    blob.upload_from_file(file_path, content_type='application/zip')
-                    print(f"{Fore.GREEN} file {file_name} uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
+                    uploads.append((file_path, today + dest_folder + os.path.basename(file_path), False))
+                elif hasattr(file_path, 'read'):
+                    uploads.append((file_path, today + dest_folder + 'prep_datasets.zip', False))
         else:
             for file_path, destination_blob_name in zip(file_paths, dest_blob):
-                if type(file_path) == io.BytesIO or type(file_path) == io.StringIO:
-                    data = pd.read_csv(file_path, sep=';')
-                    destination_blob_name_raw = today + dest_folder + destination_blob_name
-                    csv_data = data.to_csv(index=False)
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob_output = bucket.blob(destination_blob_name_raw)
-                    blob_output.upload_from_string(csv_data, content_type='text/csv')
-                    print(f"{Fore.GREEN}{destination_blob_name} is uncompressed and uploaded to {destination_blob_name_raw}.{Style.RESET_ALL}")
-
-                    # print(type(file_path))
-                    # print(file_path)
-                    # destination_blob_name_raw = today + dest_folder + destination_blob_name
-                    # bucket = self.storage_client.bucket(self.bucket_name)
-                    # blob = bucket.blob(destination_blob_name_raw)
-                    # blob.upload_from_string(file_path, timeout=300)
-                    # print(f"{Fore.GREEN} file {destination_blob_name} uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
-                else:     
-                    print(type(file_path))
-                    print(file_path)
-                    destination_blob_name_raw = today + dest_folder + destination_blob_name
-                    bucket = self.storage_client.bucket(self.bucket_name)
-                    blob = bucket.blob(destination_blob_name_raw)
-                    blob.upload_from_filename(file_path, timeout=300)
-                    print(f"{Fore.GREEN} file {destination_blob_name} uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
-            
+                uploads.append((file_path, today + dest_folder + destination_blob_name, hasattr(file_path, 'read')))
+
+        def upload(file_path, destination_blob_name_raw, csv_from_file):
+            try:
+                result = self.upload_file(file_path, destination_blob_name_raw, csv_from_file, large_file_size,
+                                          chunk_size, chunk_workers)
+                result['error'] = None
+                print(f"{Fore.GREEN} file {os.path.basename(destination_blob_name_raw)} uploaded to GCS successfully to {destination_blob_name_raw}.{Style.RESET_ALL}")
+            except Exception as e:
+                result = {'source': self.source_name(file_path), 'blob': destination_blob_name_raw, 'size': None, 'seconds': None,
+                          'error': f"{type(e).__name__}: {e}"}
+                print(f"{Fore.RED}Upload of {destination_blob_name_raw} failed with error {e}.{Style.RESET_ALL}")
+            return result
+
+        if max_workers is None:
+            results = [upload(*arguments) for arguments in uploads]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda arguments: upload(*arguments), uploads))
+        failed = sum(result['error'] is not None for result in results)
+        print(f"{len(results) - failed} of {len(results)} files uploaded to GCS.")
+        return results
 
     def list_blobs(self):
         """
@@ -12,7 +12,10 @@ import zipfile
 import gzip
 import zipfile
 import re
+import json
 from unidecode import unidecode
+from classes.archive_manifest import ArchiveManifest
+from classes.dtype_inference import DtypeInferer
 
 class FromGCStoGBQ:
     """
@@ -112,43 +115,48 @@ class FromGCStoGBQ:
             print(f"{Fore.GREEN}{blob.name} is uploaded to {table_name}{Style.RESET_ALL}")
 
     def upload_zip_to_bq(self, zip_file):
-        file_list = [file for file in zip_file.namelist()]
-        filtered_list = list(filter(lambda x: not x.endswith('/'), file_list))
-        for filename in filtered_list:
+        """
+        Uploads every member of a prepped archive to its own BigQuery table
+
+        Parameters
+        ----------
+        zip_file : zipfile.ZipFile
+            archive returned by PrepFilesBQ.process_zip_file, member names are parsed by ArchiveManifest.
+            CSV members are read with pandas, with the dtypes and BigQuery schema of their '.schema.json' if they
+            have one, and without it if they can't be read with it. Parquet members are loaded by BigQuery as they are, their types being stored in the file.
+        """
+        manifest = ArchiveManifest(zip_file).parse(self.project_id + '.' + self.dataset_name)
+        for row in manifest.itertuples():
             print("---------------------")
-            print(filename)
-            filename_bq = filename.split('/')[1]
-            print(filename_bq)
-            pattern = "_v(?=\d{4})"
-            split_name = re.split(pattern, filename_bq)
-            filename_bq = unidecode(split_name[0]).lower()
-            date_ext = split_name[1]
-            date_ext = date_ext.replace('.csv', '')
-            if "_csv" in date_ext:
-                ext = "csv"
-                date_date = date_ext.split('_')[0] + '-' + date_ext.split('_')[1] + '-' + date_ext.split('_')[2]
-                print(date_date)
-                print(ext)
-            elif "_xlsx" in date_ext:
-                ext = "xlsx"
-                date_date = date_ext.split('_')[0] + '-' + date_ext.split('_')[1] + '-' + date_ext.split('_')[2]
-                print(date_date)
-                print(ext)
-            else:
-                ext = "csv"
-                date_date = date_ext
-                print(date_date)
-                print(ext)
-            print(filename_bq)
-            table_name = self.project_id + '.' + self.dataset_name + "." + filename_bq
+            print(row.member)
+            print(row.updated_at.date() if pd.notna(row.updated_at) else None)
+            print(row.source_format)
+            table_name = row.bq_dest_table
             print('this is the table name: ', table_name)
             print("---------------------")
                 
-            with zip_file.open(filename) as myfile:
+            with zip_file.open(row.member) as myfile:
                 try:
-                  df = pd.read_csv(myfile, sep=";")
-                  pandas_gbq.to_gbq(df, table_name, project_id=self.project_id, if_exists='replace', api_method= "load_csv")
-                  print(f"{Fore.GREEN}{filename} is uploaded to {table_name}{Style.RESET_ALL}")
+                  if row.file_format == 'parquet':
+                    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET,
+                                                        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+                    self.bq_client.load_table_from_file(myfile, table_name, job_config=job_config).result()
+                  elif row.schema_member is not None:
+                    schema = json.loads(zip_file.read(row.schema_member))
+                    try:
+                      df = pd.read_csv(myfile, sep=";", **DtypeInferer().read_options(schema))
+                    except (ValueError, TypeError) as e:
+                      # the table is still loaded, with the types guessed by pandas and BigQuery
+                      print(f"{Fore.YELLOW}Schema of {row.member} not applied, loading it without: {e}{Style.RESET_ALL}")
+                      schema = None
+                      with zip_file.open(row.member) as retry_file:
+                        df = pd.read_csv(retry_file, sep=";")
+                    pandas_gbq.to_gbq(df, table_name, project_id=self.project_id, if_exists='replace', api_method= "load_csv",
+                                      table_schema=schema)
+                  else:
+                    df = pd.read_csv(myfile, sep=";")
+                    pandas_gbq.to_gbq(df, table_name, project_id=self.project_id, if_exists='replace', api_method= "load_csv")
+                  print(f"{Fore.GREEN}{row.member} is uploaded to {table_name}{Style.RESET_ALL}")
                 except Exception as e:
                   print(f"{Fore.RED}Error: {e}{Style.RESET_ALL}")  
 
@@ -5,31 +5,84 @@ class FolderLister:
     self.folder_path = folder_path
 
   def list_folders(self):
-    folder_list = []
-    for item in os.listdir(self.folder_path):
-      item_path = os.path.join(self.folder_path, item)
-      if os.path.isdir(item_path):
-        folder_list.append(item)
-    return folder_list
-  
-  def list_files(self):
-        file_list = []
-        for folder in self.list_folders():
-            folder_path = os.path.join(self.folder_path, folder)
-            for item in os.listdir(folder_path):
-                item_path = os.path.join(folder_path, item)
-                if os.path.isfile(item_path):
-                    file_list.append(item)
-        return file_list
-  
-  def list_rel_paths(self):
-        file_list = []
-        for folder in self.list_folders():
-            folder_path = os.path.join(self.folder_path, folder)
-            for item in os.listdir(folder_path):
-                item_path = os.path.join(folder_path, item)
-                if os.path.isfile(item_path):
-                    relative_path = os.path.relpath(item_path, self.folder_path)
-                    relative_path = self.folder_path + '/' + relative_path
-                    file_list.append(relative_path)
-        return file_list
+    with os.scandir(self.folder_path) as entries:
+      return [entry.name for entry in entries if entry.is_dir()]
+
+  def match_entry(self, entry, extensions=None, min_mtime=None, max_mtime=None, min_size=None, max_size=None):
+    """
+    Check a file against the filters of iter_files. The stat data is only read when a
+    mtime or size filter is set, and is cached by the DirEntry.
+    """
+    if extensions is not None:
+      extension = os.path.splitext(entry.name)[1].lower()
+      if extension not in extensions:
+        return False
+    if min_mtime is None and max_mtime is None and min_size is None and max_size is None:
+      return True
+    stat = entry.stat()
+    if min_mtime is not None and stat.st_mtime < min_mtime:
+      return False
+    if max_mtime is not None and stat.st_mtime > max_mtime:
+      return False
+    if min_size is not None and stat.st_size < min_size:
+      return False
+    if max_size is not None and stat.st_size > max_size:
+      return False
+    return True
+
+  def iter_files(self, extensions=None, min_mtime=None, max_mtime=None, min_size=None, max_size=None,
+                 min_depth=0, max_depth=None):
+    """
+    Walk the folder recursively with os.scandir and yield its files lazily, as os.DirEntry objects.
+
+    Parameters:
+    - extensions (list): Extensions to keep, e.g. ['.csv', '.xlsx'], '' for files without extension. All if None.
+    - min_mtime, max_mtime (float): Bounds of the modification time, as a timestamp.
+    - min_size, max_size (int): Bounds of the size in bytes.
+    - min_depth (int): Minimum depth of the files, 0 for the files directly in folder_path.
+    - max_depth (int): Maximum depth of the files, no limit if None.
+
+    Yields:
+    - os.DirEntry: Each matching file.
+    """
+    if extensions is not None:
+      extensions = {extension.lower() for extension in extensions}
+    filters = dict(extensions=extensions, min_mtime=min_mtime, max_mtime=max_mtime, min_size=min_size, max_size=max_size)
+
+    # only one directory is open at a time, subfolders are visited after the files of their parent. Symlinked
+    # subfolders are followed as os.path.isdir does, but not into a folder (device and inode) the path already
+    # went through, so that a symlink loop ends
+    stat = os.stat(self.folder_path)
+    stack = [(self.folder_path, 0, frozenset([(stat.st_dev, stat.st_ino)]))]
+    while stack:
+      folder_path, depth, visited = stack.pop()
+      subfolders = []
+      with os.scandir(folder_path) as entries:
+        for entry in entries:
+          if entry.is_dir():
+            if max_depth is None or depth < max_depth:
+              stat = entry.stat()
+              if (stat.st_dev, stat.st_ino) not in visited:
+                subfolders.append((entry.path, depth + 1, visited | {(stat.st_dev, stat.st_ino)}))
+          elif depth >= min_depth and entry.is_file() and self.match_entry(entry, **filters):
+            yield entry
+      stack.extend(reversed(subfolders))
+
+  def list_files(self, recursive=False, **filters):
+    """
+    List the names of the files of the subfolders, at any depth if recursive. See iter_files for the filters.
+    """
+    max_depth = None if recursive else 1
+    return [entry.name for entry in self.iter_files(min_depth=1, max_depth=max_depth, **filters)]
+
+  def list_rel_paths(self, recursive=False, **filters):
+    """
+    List the paths of the files of the subfolders, prefixed by folder_path, at any depth if recursive.
+    See iter_files for the filters.
+    """
+    max_depth = None if recursive else 1
+    file_list = []
+    for entry in self.iter_files(min_depth=1, max_depth=max_depth, **filters):
+      relative_path = os.path.relpath(entry.path, self.folder_path)
+      file_list.append(self.folder_path + '/' + relative_path)
+    return file_list
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+class PrepCache:
+    """
+    Class for caching prepped files on disk, keyed by the content of the raw file.
+
+    The key of an entry is the sha256 of the raw bytes, of the version of the prep logic and of the options
+    changing its output, so an unchanged file is never prepped twice, whatever its name. An entry is a folder
+    holding the files written for the raw file and a manifest.json describing them. The least recently used
+    entries are evicted once the cache is larger than max_bytes.
+
+    Attributes:
+    - folder (str): Folder of the cache.
+    - max_bytes (int): Maximum size of the cache in bytes.
+    - chunk_size (int): Size in bytes of the chunks read to hash a file.
+
+    Methods:
+    - __init__(folder, max_bytes, chunk_size): Constructor method that initializes the cache.
+    - hash_file(file): Computes the sha256 of a file.
+    - key(content_hash, version, options): Computes the key of an entry.
+    - entry_path(key): Helper method to build the folder of an entry.
+    - get(key): Returns the manifest of an entry, or None if it isn't cached.
+    - new_entry(): Creates a temporary folder where an entry is written.
+    - commit(key, temp_path, manifest): Adds an entry written in a temporary folder to the cache.
+    - entry_size(path): Helper method to compute the size of an entry.
+    - evict(): Removes the least recently used entries until the cache fits in max_bytes.
+    """
+
+    def __init__(self, folder='data/.prep_cache', max_bytes=2 * 1024 ** 3, chunk_size=1024 * 1024):
+        """
+        Initialize the PrepCache object.
+
+        Parameters:
+        - folder (str): Folder of the cache, created if needed.
+        - max_bytes (int): Maximum size of the cache in bytes.
+        - chunk_size (int): Size in bytes of the chunks read to hash a file.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        os.makedirs(folder, exist_ok=True)
+
+    def hash_file(self, file):
+        """
+        Compute the sha256 of a file, one chunk at a time.
+
+        Parameters:
+        - file (str or file object): Path or binary file, rewound after hashing.
+
+        Returns:
+        - str: Hex digest of the content.
+        """
+        hasher = hashlib.sha256()
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    hasher.update(chunk)
+        else:
+            file.seek(0)
+            for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                hasher.update(chunk)
+            file.seek(0)
+        return hasher.hexdigest()
+
+    def key(self, content_hash, version, options):
+        """
+        Compute the key of an entry.
+
+        Parameters:
+        - content_hash (str): sha256 of the raw file.
+        - version (int or str): Version of the prep logic, to bump when its output changes.
+        - options (dict): Options changing the output, must be serializable as JSON.
+
+        Returns:
+        - str: Hex digest identifying the entry.
+        """
+        description = json.dumps({'content': content_hash, 'version': version, 'options': options}, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        """
+        Return the manifest of an entry, and mark it as recently used.
+
+        Parameters:
+        - key (str): Key of the entry.
+
+        Returns:
+        - dict: Manifest of the entry, with the folder of its files as 'path', or None if it isn't cached.
+        """
+        path = self.entry_path(key)
+        try:
+            with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        manifest['path'] = path
+        return manifest
+
+    def new_entry(self):
+        """
+        Create a temporary folder in the cache, where the files of a new entry are written before commit().
+        """
+        return tempfile.mkdtemp(prefix='.tmp_', dir=self.folder)
+
+    def commit(self, key, temp_path, manifest):
+        """
+        Add an entry written in a temporary folder to the cache. If another process added it meanwhile, its
+        entry is kept and the temporary folder is removed.
+
+        Parameters:
+        - key (str): Key of the entry.
+        - temp_path (str): Folder returned by new_entry() holding the files of the entry.
+        - manifest (dict): Description of the files, serializable as JSON.
+
+        Returns:
+        - str: Folder of the entry.
+        """
+        with open(os.path.join(temp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        path = self.entry_path(key)
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return path
+
+    def entry_size(self, path):
+        with os.scandir(path) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+        - int: Number of entries removed.
+        """
+        with os.scandir(self.folder) as entries:
+            cached = [(entry.stat().st_mtime, entry.path) for entry in entries
+                      if entry.is_dir() and not entry.name.startswith('.tmp_')]
+        sizes = {path: self.entry_size(path) for _, path in cached}
+        total = sum(sizes.values())
+        removed = 0
+        for _, path in sorted(cached):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            removed += 1
+        return removed
@@ -1,14 +1,27 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pandas.errors import ParserError
 from google.oauth2 import service_account
 from google.cloud import storage
 import zipfile
 import tempfile
 import os
+import importlib.util
+from datetime import datetime
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 import io
 from colorama import Fore, Style
 import re
+import csv
+import json
 from unidecode import unidecode
+from classes.bad_lines import BadLinesReport, BadLinesError
+from classes.dtype_inference import DtypeInferer
+from classes.prep_cache import PrepCache
+from classes.stage_profiler import StageProfiler
 from IPython.display import display
 
 class ZipFileProcessor:
@@ -44,40 +57,105 @@ class ZipFileProcessor:
 
 class PrepFilesBQ:
 
-    def __init__(self, paths=None, zip_file=None):
+    # size above which the output archive of process_zip_file is moved from memory to disk
+    spool_size = 64 * 1024 * 1024
+    # number of bytes read at the start of a CSV file to guess its dialect
+    sniff_size = 64 * 1024
+    sniff_delimiters = [',', ';', '\t', '|']
+    output_formats = {'csv': '.csv', 'parquet': '.parquet'}
+    engines = ['c', 'python', 'pyarrow']
+    # python-calamine reads xlsx files several times faster than openpyxl, which is used when it isn't installed
+    excel_engine = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+    # formats of a resource published several times, from the cheapest to parse to the most expensive
+    twin_preference = ['.csv', '.xlsx']
+    # version of the prep logic in the keys of the prep cache, to bump when a change alters the prepped files
+    prep_version = 3
+
+    def __init__(self, paths=None, zip_file=None, chunksize=None, workers=None, max_bad_lines_ratio=0.01, output_format='csv',
+                 engine='c', infer_dtypes=False, excel_sheets=0, skip_twins=False, check_twins=False, twin_sample_rows=100,
+                 cache_dir=None, cache_max_bytes=2 * 1024 ** 3, trace_memory=False, stage_hook=None, display_dfs=False):
+        if output_format not in self.output_formats:
+            raise ValueError(f"output_format must be one of {list(self.output_formats)}, got {output_format!r}")
+        if engine not in self.engines:
+            raise ValueError(f"engine must be one of {self.engines}, got {engine!r}")
         self.paths = paths
         self.zip_file = zip_file
+        # number of rows processed at a time for CSV files, files are loaded in full if None
+        self.chunksize = chunksize
+        # number of processes the files are spread over, files are processed one after another if None
+        self.workers = workers
+        # maximum share of rows a CSV file can lose to bad lines, the file is rejected above it (no limit if None)
+        self.max_bad_lines_ratio = max_bad_lines_ratio
+        # bad lines of the last CSV read, and the report of each file processed
+        self.bad_lines_report = None
+        self.bad_lines_reports = []
+        # format of the prepped files, 'csv' (separated by ';') or 'parquet' (dtypes kept)
+        self.output_format = output_format
+        self.output_extension = self.output_formats[output_format]
+        # parser of the CSV files, see benchmarks/bench_csv_engines.py to compare them on a corpus. Files whose first
+        # sniff_size bytes aren't UTF-8 are always parsed by the C engine: pyarrow can't give the text of their bad lines
+        self.engine = engine
+        # compact dtypes are given to the prepped columns if set, and a '.schema.json' BigQuery schema is written next to each file
+        self.dtype_inferer = DtypeInferer() if infer_dtypes else None
+        # BigQuery schema of the file last processed, None without dtype inference
+        self.schema = None
+        # sheets read from Excel files: a sheet name or position, a list of them, or None for all the sheets.
+        # With a list, or None and a workbook of several sheets, each sheet is written as a table of its own, named
+        # after the file and the sheet. The table of a workbook of a single sheet keeps the name of the file
+        self.excel_sheets = excel_sheets
+        # if skip_twins, a file having a twin in a cheaper format (same folder and name, e.g. a .csv for a .xlsx) isn't
+        # processed, unless check_twins is set and the first twin_sample_rows rows of the twins differ. Off by default:
+        # the csv twin may hold numbers formatted as text ('4 971 196') where the xlsx one has typed values
+        self.skip_twins = skip_twins
+        self.check_twins = check_twins
+        self.twin_sample_rows = twin_sample_rows
+        self.skipped_twins = {}
+        # files already prepped with the same content and options are copied from this cache (e.g. 'data/.prep_cache')
+        # instead of being prepped again, the least recently used ones are evicted above cache_max_bytes
+        self.prep_cache = PrepCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+        # wall time and shapes of each stage of each file (and peak memory if trace_memory), see write_run_report
+        self.profiler = StageProfiler(trace_memory, stage_hook)
+        # the DataFrames opened from disk are rendered with IPython display if set
+        self.display_dfs = display_dfs
+
+    def __getstate__(self):
+        # sent to the worker processes, which get the file they process explicitly
+        state = self.__dict__.copy()
+        state['paths'] = None
+        state['zip_file'] = None
+        state['bad_lines_reports'] = []
+        return state
 
     def verify_error_onbadlines(self, path, df):
-        with open(path) as f:
-            len_csv = sum(1 for line in f)
+        """
+        Kept for compatibility, the bad lines are now counted while the file is parsed (see read_csv)
+        instead of reading it again.
+        """
+        report = self.bad_lines_report
+        if report is None:
+            return df
 
-        print(len_csv)
+        print(report.total)
         print(df.shape)
-        number_of_skipped_rows = len_csv - df.shape[0]
-        print('number_of_skipped_rows:' , number_of_skipped_rows)
-        errors_imp = number_of_skipped_rows/len_csv * 100
-        if errors_imp > 1:
-            print('More than 1 percent of rows skipped, file is not good')
+        print('number_of_skipped_rows:' , report.skipped)
+        if report.max_ratio is not None and report.ratio > report.max_ratio:
+            print(f'More than {report.max_ratio:.2%} of rows skipped, file is not good')
             df = None
         else:
-            print('More less 1 percent of rows skipped, file is okay')
+            print(f'Less than {report.max_ratio:.2%} of rows skipped, file is okay' if report.max_ratio is not None
+                  else 'No limit on skipped rows, file is okay')
         
         return df
 
-    def correct_shape(self, file, df):
+    def correct_shape(self, file, df, reread=True):
         try:
-            if df.shape[1] == 1:
+            if df.shape[1] == 1 and reread:
                 print('columns shape is 1, csv read with ;')
                 print(type(file))
-                if 'zipfile.ZipExtFile' in str(type(file)):
-                    file.seek(0)
-                df = pd.read_csv(file, sep=';')
+                df = self.read_csv(file, sep=';')
                 if df.shape[1] == 1:
                     print('try to find headers in 2nd row')
-                    if 'zipfile.ZipExtFile' in str(type(file)):
-                        file.seek(0)
-                    df = pd.read_csv(file, sep=';', skiprows=1)
+                    df = self.read_csv(file, sep=';', skiprows=1)
                 else:
                     df = df
             elif 'unnamed' in str(df.columns[1]).lower():
@@ -110,19 +188,153 @@ class PrepFilesBQ:
 
         return df
 
+    def read_csv(self, file, **kwargs):
+        """
+        Read a CSV file from its start, every CSV read of the class goes through this method.
+
+        Files are parsed with self.engine. When the python or pyarrow engine fails for another reason than bad lines
+        (e.g. an option it doesn't support), the file is read again with the C engine, so that the fallbacks of the
+        callers see the usual errors. Chunked reads always use the C engine, the only one supporting them efficiently,
+        and so do pyarrow reads of files which aren't UTF-8 (unless an encoding is given), which pyarrow can't count
+        the bad lines of. Invalid UTF-8 after the first sniff_size bytes still sends a pyarrow read to the C engine.
+
+        Bad lines are skipped and counted by the parser in self.bad_lines_report, and BadLinesError (a ParserError)
+        is raised when they are more than max_bad_lines_ratio of the rows. Chunked reads stay strict, because the
+        C engine doesn't skip the bad lines of every chunk reliably: a ParserError sends the file to a full read.
+        """
+        if 'chunksize' in kwargs:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            return pd.read_csv(file, **kwargs)
+        engine = kwargs.pop('engine', self.engine)
+        if engine == 'pyarrow' and 'encoding' not in kwargs and not self.is_utf8(file):
+            engine = 'c'
+        if engine != 'c':
+            try:
+                return self.parse_csv(file, engine, kwargs)
+            except BadLinesError:
+                raise
+            except Exception as e:
+                print(f"{Fore.YELLOW}{engine} engine failed ({type(e).__name__}: {e}), reading with the C engine{Style.RESET_ALL}")
+        return self.parse_csv(file, 'c', kwargs)
+
+    def parse_csv(self, file, engine, kwargs):
+        """
+        Parse a CSV file from its start with a given engine, counting its bad lines.
+        """
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        kwargs = dict(kwargs, engine=engine)
+        if engine == 'pyarrow' and kwargs.get('skiprows') and kwargs.get('header', 'infer') in ('infer', 0):
+            # the pyarrow engine ignores skiprows when the headers are read, the rows before them are skipped with header
+            kwargs['header'] = kwargs.pop('skiprows')
+        report = BadLinesReport(self.max_bad_lines_ratio)
+        self.bad_lines_report = report
+        with report.capture():
+            df = pd.read_csv(file, **report.read_options(kwargs))
+        report.check(df.shape[0])
+        if engine == 'pyarrow':
+            # the C engine names the columns without header 'Unnamed: <position>', which correct_shape relies on
+            df.columns = [column if column != '' else f'Unnamed: {index}' for index, column in enumerate(df.columns)]
+        return df
+
+    def read_sample(self, file):
+        """
+        Read the first sniff_size bytes of a file (path or file object) and rewind it.
+        """
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                return f.read(self.sniff_size)
+        file.seek(0)
+        sample = file.read(self.sniff_size)
+        file.seek(0)
+        return sample
+
+    def is_utf8(self, file):
+        """
+        Check that the first sniff_size bytes of a file are UTF-8, a multi-byte character may be cut at the end.
+        """
+        sample = self.read_sample(file)
+        try:
+            sample.decode('utf-8')
+        except UnicodeDecodeError as e:
+            return len(sample) == self.sniff_size and e.start >= len(sample) - 4
+        return True
+
+    def sniff_csv(self, file):
+        """
+        Guess the delimiter, the row of the headers and the quote character of a CSV file from its first bytes,
+        so it can be parsed only once.
+
+        Returns a dict of read_csv options (sep, skiprows, quotechar), or None if the sample doesn't look
+        like delimited text.
+        """
+        sample = self.read_sample(file)
+        if not sample or sample.startswith(b'PK\x03\x04') or b'\x00' in sample:
+            return None
+        try:
+            text = sample.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # a multi-byte character may be cut at the end of the sample
+            if e.start < len(sample) - 4:
+                return None
+            text = sample[:e.start].decode('utf-8')
+        text = text.lstrip('\ufeff')
+        lines = text.splitlines()
+        if len(sample) == self.sniff_size and len(lines) > 1:
+            lines = lines[:-1]
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return None
+
+        try:
+            quotechar = csv.Sniffer().sniff('\n'.join(lines[:50]), delimiters=''.join(self.sniff_delimiters)).quotechar
+        except csv.Error:
+            quotechar = '"'
+
+        best = None
+        for delimiter in self.sniff_delimiters:
+            counts = [len(fields) for fields in csv.reader(lines, delimiter=delimiter, quotechar=quotechar)]
+            width = max(set(counts), key=counts.count)
+            if width < 2:
+                continue
+            consistency = counts.count(width) / len(counts)
+            score = (consistency, width)
+            if best is None or score > best[0]:
+                # headers are on the first row having the usual number of fields, e.g. after a title row
+                skiprows = counts.index(width)
+                best = (score, delimiter, skiprows)
+
+        if best is None or best[0][0] < 0.5 or best[2] > 10:
+            return None
+        return {'sep': best[1], 'skiprows': best[2], 'quotechar': quotechar}
+
     def open_csv_file(self, path, file):
         if file is None:
             file = path
         print('file:', file)
         print('path:', path)
+
+        with self.profiler.stage('sniff'):
+            dialect = self.sniff_csv(file)
+        if dialect is not None:
+            print('sniffed dialect:', dialect)
+            try:
+                df = self.read_csv(file, **dialect)
+                print(df.shape)
+                return self.correct_shape(file, df, reread=False)
+            except (ParserError, UnicodeDecodeError) as e:
+                print(f"{Fore.RED}Exception type (sniffed dialect): {type(e).__name__}{Style.RESET_ALL}")
+                print(e)
+
         try:
-            df = pd.read_csv(file)
+            df = self.read_csv(file)
         except ParserError as e:
             print(f"{Fore.RED}Exception type (first attempt): {type(e).__name__}{Style.RESET_ALL}")
             print(e)
             print('trying to open csv with sep = ";"')
             try:
-                df = pd.read_csv(file, sep=';')
+                df = self.read_csv(file, sep=';')
             except Exception as e:
                 print(f"{Fore.RED}Exception type (second attempt): {type(e).__name__}{Style.RESET_ALL}")
                 print(f"{Fore.RED}Exception: {e}{Style.RESET_ALL}")
@@ -139,7 +351,22 @@ class PrepFilesBQ:
     def open_excel_file(self, path, file):
         if file is None:
             file = path
-        df = pd.read_excel(file)
+        self.bad_lines_report = None
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        df = pd.read_excel(file, sheet_name=self.excel_sheets, engine=self.excel_engine)
+        if isinstance(df, dict) and self.excel_sheets is None and len(df) == 1:
+            # a workbook of a single sheet keeps the name of its table, as with the default excel_sheets=0
+            df = next(iter(df.values()))
+        if isinstance(df, dict):
+            # the headers of each sheet are recovered as for a single sheet, sheets without a table are left out
+            sheets = {}
+            for sheet, sheet_df in df.items():
+                print(sheet, sheet_df.shape)
+                sheet_df = self.correct_shape(file, sheet_df, reread=False)
+                if sheet_df is not None:
+                    sheets[sheet] = sheet_df
+            return sheets or None
         print(df.shape)
         df = self.correct_shape(file, df)
         return df
@@ -152,7 +379,7 @@ class PrepFilesBQ:
                 column = re.sub(r'[!\"$()\*\.,\/;?\@\[\]\\^`{}\~]', '', column)
                 column = column.strip().lower().replace(" ", "_")
                 column = unidecode(column)
-                column = column.replace("\n", "_")
+                column = column.replace("\r\n", "_").replace("\n", "_").replace("\r", "_")
                 column = column.replace("'", "")
                 column = column.replace("-", "")
                 column = column.replace("&", 'and')
@@ -222,13 +449,11 @@ class PrepFilesBQ:
                     print(f"{Fore.RED}Exception: {e}{Style.RESET_ALL}")
                     print('try to read as excel')
                     df = self.open_excel_file(path, file)
-                    print(df.shape)
                 except UnicodeError as e:
                     print(f"{Fore.RED}Exception type: {type(e).__name__}{Style.RESET_ALL}")
                     print(f"{Fore.RED}Exception: {e}{Style.RESET_ALL}")
                     print('try to read as excel')
                     df = self.open_excel_file(path, file)
-                    print(df.shape)
             except Exception as e:
                 print(f"{Fore.RED}Exception type: {type(e).__name__}{Style.RESET_ALL}")
                 print(f"{Fore.RED}Exception: {e}{Style.RESET_ALL}")
@@ -245,7 +470,165 @@ class PrepFilesBQ:
         else:
             return df
     
-    def return_csv(self, df, path):
+    def prep_df(self, df):
+        with self.profiler.stage('transpose', df) as stage:
+            df = self.transposed(df)
+            stage.output(df)
+        with self.profiler.stage('drop_empty', df) as stage:
+            df = self.drop_empty_columns(df)
+            stage.output(df)
+        with self.profiler.stage('format', df) as stage:
+            df = self.columns_formatter(df)
+            df = self.check_column_clean(df)
+            stage.output(df)
+        with self.profiler.stage('dedupe', df) as stage:
+            df = self.rename_duplicate_columns(df)
+            stage.output(df)
+        if self.dtype_inferer is not None:
+            with self.profiler.stage('infer', df) as stage:
+                df, kinds = self.dtype_inferer.infer(df)
+                self.schema = self.dtype_inferer.schema(df.columns, kinds)
+                stage.output(df)
+        return df
+
+    def prepare_columns(self, columns):
+        """
+        Apply the header normalization of prep_df to a list of columns, without loading any data.
+        """
+        df = pd.DataFrame(columns=columns)
+        df = self.columns_formatter(df)
+        df = self.check_column_clean(df)
+        df = self.rename_duplicate_columns(df)
+        return list(df.columns)
+
+    def merge_dtype(self, dtype, other):
+        """
+        Dtype pandas would have inferred for a column over the whole file, from the dtypes of two chunks.
+        """
+        if dtype is None or dtype == other:
+            return other
+        if pd.api.types.is_numeric_dtype(dtype) and pd.api.types.is_numeric_dtype(other) \
+                and not pd.api.types.is_bool_dtype(dtype) and not pd.api.types.is_bool_dtype(other):
+            return np.dtype('float64')
+        return np.dtype(object)
+
+    def count_non_null(self, file, dialect):
+        """
+        First pass of the chunked mode: count the non null values of each column and merge the dtypes
+        inferred for each chunk (and the kinds detected by dtype_inferer), one chunk at a time.
+
+        Returns the first chunk, the counts, the dtypes, the kinds and the number of chunks.
+        """
+        first = None
+        non_null = None
+        dtypes = {}
+        kinds = {}
+        n_chunks = 0
+        with self.read_csv(file, chunksize=self.chunksize, **dialect) as reader:
+            for chunk in reader:
+                if first is None:
+                    first = chunk
+                counts = chunk.notna().sum()
+                non_null = counts if non_null is None else non_null + counts
+                for column, dtype in chunk.dtypes.items():
+                    dtypes[column] = self.merge_dtype(dtypes.get(column), dtype)
+                if self.dtype_inferer is not None:
+                    for column in chunk.columns:
+                        kinds[column] = self.dtype_inferer.merge(kinds.get(column), self.dtype_inferer.detect(chunk[column]))
+                n_chunks += 1
+        return first, non_null, dtypes, kinds, n_chunks
+
+    def process_csv_chunked(self, path, file, open_output):
+        """
+        Prep a CSV file chunksize rows at a time, so memory is bounded by one chunk whatever the size of the file.
+
+        A first pass finds the empty columns and the dtype of each column, the headers are normalized once, and a second pass writes each
+        chunk to the output as soon as it is prepped. Files fitting in a single chunk go through prep_df as usual.
+
+        Parameters:
+        - path (str): Path of the file.
+        - file (file object): Opened file, or None to read from path.
+        - open_output (callable): Returns the binary file the prepped file is written to, only called once every chunk is written.
+
+        Returns:
+        - bool: False if the file isn't a delimited text file and has to go through open_df.
+        """
+        if file is None:
+            file = path
+        with self.profiler.stage('sniff'):
+            dialect = self.sniff_csv(file)
+        if dialect is None:
+            return False
+        print('sniffed dialect:', dialect, 'chunksize:', self.chunksize)
+        try:
+            # the first pass reads the whole file, the open stage doesn't hold the rows of the chunks
+            with self.profiler.stage('open'):
+                first, non_null, dtypes, kinds, n_chunks = self.count_non_null(file, dialect)
+                if n_chunks > 1 and first.shape[1] > 1 and 'unnamed' in str(first.columns[1]).lower():
+                    print('try to find headers in 2nd row')
+                    dialect['skiprows'] += 1
+                    first, non_null, dtypes, kinds, n_chunks = self.count_non_null(file, dialect)
+        except ParserError as e:
+            print(f"{Fore.RED}Exception type (chunked read): {type(e).__name__}{Style.RESET_ALL}")
+            print(e)
+            return False
+        if first is None:
+            return False
+
+        if n_chunks == 1:
+            df = self.correct_shape(file, first, reread=False)
+            if df is None:
+                return False
+            df = self.prep_df(df)
+            with self.profiler.stage('write', df) as stage:
+                stage.output(df)
+                self.write_chunks([df], open_output)
+            self.bad_lines_report = BadLinesReport(self.max_bad_lines_ratio)
+            self.bad_lines_report.rows = first.shape[0]
+            return True
+
+        kept_columns = [column for column in first.columns if non_null[column] > 0]
+        new_columns = self.prepare_columns(kept_columns)
+        first = None
+        if self.dtype_inferer is not None:
+            # categories would differ from one chunk to the other, they are written as text
+            new_kinds = {new: kinds[column] if kinds[column] != 'category' else 'string' for column, new in zip(kept_columns, new_columns)}
+            self.schema = self.dtype_inferer.schema(new_columns, new_kinds)
+
+        def prepped_chunks():
+            # every chunk is read with the dtypes of the whole file, so values are written the same way in all of them
+            with self.read_csv(file, chunksize=self.chunksize, dtype=dtypes, **dialect) as reader:
+                for chunk in reader:
+                    chunk = chunk[kept_columns]
+                    chunk.columns = new_columns
+                    if self.dtype_inferer is not None:
+                        for index, column in enumerate(new_columns):
+                            chunk.isetitem(index, self.dtype_inferer.convert(chunk.iloc[:, index], new_kinds[column]))
+                    yield chunk
+
+        # the second pass is read, prepped and written chunk by chunk, as a single stage
+        with self.profiler.stage('write') as stage:
+            n_rows = self.write_chunks(prepped_chunks(), open_output)
+            stage.output(rows=n_rows)
+            stage.columns_out = len(new_columns)
+        print((n_rows, len(new_columns)))
+        # chunked reads are strict, the file has no bad line
+        self.bad_lines_report = BadLinesReport(self.max_bad_lines_ratio)
+        self.bad_lines_report.rows = n_rows
+        return True
+
+    def sheet_name(self, name, sheet):
+        """
+        Add the name of an Excel sheet to a file name, before its '_vYYYY_MM_DD' version (or its extension).
+        """
+        if sheet is None:
+            return name
+        slug = re.sub(r'[^0-9a-z]+', '_', unidecode(str(sheet)).lower()).strip('_')
+        versions = list(re.finditer(r'_v\d{4}[-_]\d{2}[-_]\d{2}', name))
+        position = versions[-1].start() if versions else len(os.path.splitext(name)[0])
+        return name[:position] + '__' + slug + name[position:]
+
+    def prep_csv_path(self, path, sheet=None):
         path_split = path.split('/')
         dataset = path_split[2]
         if '.' in path_split[3]:
@@ -255,72 +638,456 @@ class PrepFilesBQ:
         else:
             table = path_split[3]
             extension = ""
+        table = self.sheet_name(table, sheet)
         table = table.replace(" ", "_")
         table = table.replace("-", "_")
         os.makedirs(f'data/prep_datasets/{path_split[2]}', exist_ok=True)
-        df.to_csv(f'data/prep_datasets/{dataset}/{table}_{extension}.csv', index=False, sep=";")
+        return f'data/prep_datasets/{dataset}/{table}_{extension}{self.output_extension}'
+
+    def return_csv(self, df, path):
+        self.write_chunks([df], lambda: open(self.prep_csv_path(path), 'wb'))
+
+    def arrow_table(self, df, schema=None):
+        """
+        Convert a prepped DataFrame to an Arrow table. Columns mixing types (e.g. numbers and text in an Excel
+        column) are written as text, columns without any value take the type of the schema or text.
+        """
+        mixed = [column for column in df.columns
+                 if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed')]
+        if mixed:
+            df = df.copy()
+            for column in mixed:
+                df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if schema is None:
+            schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema],
+                               metadata=table.schema.metadata)
+        return table.cast(schema)
+
+    def write_chunks(self, chunks, open_output):
+        """
+        Write prepped DataFrames one after another as a single file in output_format, the headers being those of the first one.
+
+        The chunks are written to a temporary file first, kept in memory while it is smaller than spool_size, and
+        open_output is only called once the last chunk is written: a chunk raising an exception leaves no truncated
+        file (or archive member) behind.
+
+        Parameters:
+        - chunks (iterable): DataFrames with the same columns.
+        - open_output (callable): Returns the binary file the prepped file is written to.
+
+        Returns:
+        - int: Number of rows written.
+        """
+        n_rows = 0
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) as buffer:
+            if self.output_format == 'parquet':
+                writer = None
+                try:
+                    for chunk in chunks:
+                        table = self.arrow_table(chunk, None if writer is None else writer.schema)
+                        if writer is None:
+                            writer = pq.ParquetWriter(buffer, table.schema)
+                        writer.write_table(table)
+                        n_rows += chunk.shape[0]
+                finally:
+                    if writer is not None:
+                        writer.close()
+            else:
+                text_output = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+                for index, chunk in enumerate(chunks):
+                    chunk.to_csv(text_output, index=False, sep=";", header=index == 0)
+                    n_rows += chunk.shape[0]
+                # the buffer is kept open to be copied to the output
+                text_output.flush()
+                text_output.detach()
+            buffer.seek(0)
+            with open_output() as output:
+                shutil.copyfileobj(buffer, output)
+        return n_rows
     
+    def write_schema(self, open_output):
+        """
+        Write the BigQuery schema of the file last processed as JSON to the binary file returned by open_output,
+        if dtypes were inferred. Sidecar files are named after their data file with a '.schema.json' suffix.
+        """
+        if self.schema is None:
+            return
+        with open_output() as output:
+            output.write(json.dumps(self.schema, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def process_file(self, path, file, open_output):
+        """
+        Open and prep one file, then write it in output_format.
+
+        open_output(sheet=None, suffix='') returns the binary file a table is written to: sheet is the Excel sheet
+        of the table, None for files holding a single table, and suffix is '.schema.json' for its schema.
+
+        Returns True if the file was processed.
+        """
+        self.bad_lines_report = None
+        self.schema = None
+        if os.path.basename(path) == '.DS_Store':
+            return False
+        with self.profiler.file(path):
+            if self.prep_cache is None:
+                return self.prep_file(path, file, open_output)
+            return self.process_file_cached(path, file, open_output)
+
+    def cache_options(self):
+        """
+        Options changing the prepped files, part of the keys of the prep cache. chunksize and workers aren't,
+        since the files are the same with or without them.
+        """
+        return {
+            'class': type(self).__name__,
+            'output_format': self.output_format,
+            'engine': self.engine,
+            'infer_dtypes': self.dtype_inferer is not None,
+            'excel_sheets': self.excel_sheets,
+            'max_bad_lines_ratio': self.max_bad_lines_ratio
+        }
+
+    def process_file_cached(self, path, file, open_output):
+        """
+        Same as process_file, through the prep cache: the raw file is hashed, and on a hit the files prepped
+        from the same content are copied to open_output without opening it. On a miss, the file is prepped into
+        a new cache entry, copied to open_output the same way. Files which failed with an exception aren't cached.
+        """
+        with self.profiler.stage('hash'):
+            key = self.prep_cache.key(self.prep_cache.hash_file(path if file is None else file), self.prep_version, self.cache_options())
+        manifest = self.prep_cache.get(key)
+        if manifest is not None:
+            print(Fore.CYAN + f"{path} found in the prep cache" + Style.RESET_ALL)
+        else:
+            entry_path = self.prep_cache.new_entry()
+            outputs = []
+
+            def open_entry(sheet=None, suffix=''):
+                outputs.append({'sheet': sheet, 'suffix': suffix, 'file': str(len(outputs))})
+                return open(os.path.join(entry_path, outputs[-1]['file']), 'wb')
+
+            try:
+                processed = self.prep_file(path, file, open_entry)
+            except Exception:
+                shutil.rmtree(entry_path, ignore_errors=True)
+                raise
+            manifest = {
+                'processed': processed,
+                'outputs': outputs,
+                'bad_lines': self.file_bad_lines(None)
+            }
+            manifest['path'] = self.prep_cache.commit(key, entry_path, manifest)
+
+        if manifest['bad_lines'] is not None:
+            self.bad_lines_report = BadLinesReport.from_dict(manifest['bad_lines'], self.max_bad_lines_ratio)
+        with self.profiler.stage('cache_copy'):
+            for output in manifest['outputs']:
+                with open(os.path.join(manifest['path'], output['file']), 'rb') as source, \
+                        open_output(output['sheet'], output['suffix']) as target:
+                    shutil.copyfileobj(source, target)
+        return manifest['processed']
+
+    def prep_file(self, path, file, open_output):
+        """
+        Prep one file and write it with open_output, see process_file.
+        """
+        if self.chunksize is not None and (path.endswith('.csv') or "." not in path):
+            if self.process_csv_chunked(path, file, open_output):
+                self.write_schema(lambda: open_output(None, '.schema.json'))
+                return True
+        with self.profiler.stage('open') as stage:
+            df = self.open_df(path, file)
+            stage.output(df)
+        print('this is df')
+        if file is None and self.display_dfs:
+            display(df)
+        if df is None:
+            return False
+        tables = df if isinstance(df, dict) else {None: df}
+        for sheet, df in tables.items():
+            self.schema = None
+            df = self.prep_df(df)
+            with self.profiler.stage('write', df) as stage:
+                stage.output(df)
+                self.write_chunks([df], lambda: open_output(sheet))
+                self.write_schema(lambda: open_output(sheet, '.schema.json'))
+        return True
+
+    def file_bad_lines(self, path):
+        """
+        Bad lines report of the file last processed, as a dict, or None if it wasn't read as CSV.
+        """
+        if self.bad_lines_report is None:
+            return None
+        return self.bad_lines_report.to_dict(path)
+
+    def process_path(self, path):
+        """
+        Prep a file on disk into data/prep_datasets. Exceptions are returned instead of raised, so that
+        one failing file doesn't stop the others.
+
+        Returns a tuple (processed, error, bad_lines, stages), stages being the stages recorded for the file.
+        """
+        start = len(self.profiler.records)
+        try:
+            open_output = lambda sheet=None, suffix='': open(self.prep_csv_path(path, sheet) + suffix, 'wb')
+            processed, error = self.process_file(path, None, open_output), None
+        except Exception as e:
+            processed, error = False, f"{type(e).__name__}: {e}"
+        return processed, error, self.file_bad_lines(path), self.profiler.records[start:]
+
+    def process_member(self, zip_path, path, output_dir):
+        """
+        Prep a member of an archive on disk into output_dir, in a worker process. Exceptions are returned
+        instead of raised, so that one failing member doesn't stop the others.
+
+        Returns a tuple (processed, error, bad_lines, names, stages), names being the member names of the files
+        written in output_dir, in the order they were written, and stages the stages recorded for the member.
+        """
+        names = []
+        start = len(self.profiler.records)
+
+        def open_output(sheet=None, suffix=''):
+            names.append(self.prep_member_name(path, sheet) + suffix)
+            output_path = os.path.join(output_dir, names[-1])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            return open(output_path, 'wb')
+
+        try:
+            with zipfile.ZipFile(zip_path) as zip_file, zip_file.open(path) as file:
+                processed, error = self.process_file(path, file, open_output), None
+        except Exception as e:
+            processed, error = False, f"{type(e).__name__}: {e}"
+        return processed, error, self.file_bad_lines(path), names, self.profiler.records[start:]
+
+    def print_result(self, path, processed, error=None, bad_lines=None):
+        if bad_lines is not None:
+            self.bad_lines_reports.append(bad_lines)
+            if bad_lines['skipped_rows']:
+                print(f"{Fore.YELLOW}{bad_lines['skipped_rows']} of {bad_lines['total_rows']} rows skipped, e.g. {bad_lines['samples'][0]}{Style.RESET_ALL}")
+        if processed:
+            print(Fore.GREEN + f"{path} processed successfully!" + Style.RESET_ALL)
+        else:
+            if error is not None:
+                print(f"{Fore.RED}Exception: {error}{Style.RESET_ALL}")
+            print(Fore.RED + f"{path} not processed!" + Style.RESET_ALL)
+        print("---------------------------------------------------")
+
+    def sample_value(self, value):
+        # values of a CSV file and of its Excel twin written the same way: 1.0 as 1, '1 234,5' as 1234.5, dates without time
+        if pd.isna(value):
+            return ''
+        if isinstance(value, datetime):
+            return str(value.date()) if value == pd.Timestamp(value).normalize() else value.isoformat()
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        text = str(value).strip()
+        number = re.sub(r'(?<=\d)[ \u00a0\u202f](?=\d{3}(?!\d))', '', text)
+        if re.fullmatch(r'-?\d+(,\d+)?', number):
+            return number.replace(',', '.')
+        return text
+
+    def twin_sample(self, path, file):
+        """
+        Read the first twin_sample_rows rows of a CSV or Excel file, with its headers recovered, as lists of text values.
+        """
+        if file is None:
+            file = path
+        if os.path.splitext(path)[1].lower() == '.csv':
+            dialect = self.sniff_csv(file) or {}
+            df = self.read_csv(file, nrows=self.twin_sample_rows, engine='c', **dialect)
+        else:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            df = pd.read_excel(file, nrows=self.twin_sample_rows, engine=self.excel_engine)
+        df = self.correct_shape(file, df, reread=False)
+        if df is None:
+            return None
+        return df.reset_index(drop=True).map(self.sample_value).values.tolist()
+
+    def same_twins(self, path, twin, open_member=None):
+        """
+        Cross-check two twins on their first rows: their values must match, and so must their number of rows
+        when both are shorter than the sample.
+        """
+        samples = []
+        for sample_path in (path, twin):
+            try:
+                if open_member is None:
+                    samples.append(self.twin_sample(sample_path, None))
+                else:
+                    with open_member(sample_path) as file:
+                        samples.append(self.twin_sample(sample_path, file))
+            except Exception as e:
+                print(f"{Fore.RED}Exception: {type(e).__name__}: {e}{Style.RESET_ALL}")
+                return False
+        sample, twin_sample = samples
+        if sample is None or twin_sample is None:
+            return False
+        if len(sample) != len(twin_sample) and max(len(sample), len(twin_sample)) < self.twin_sample_rows:
+            return False
+        # the header recovery of CSV and Excel files may differ by a row, so the samples are compared with an offset of one row too
+        for offset, twin_offset in [(0, 0), (1, 0), (0, 1)]:
+            n_rows = min(len(sample) - offset, len(twin_sample) - twin_offset)
+            if n_rows > 0 and sample[offset:offset + n_rows] == twin_sample[twin_offset:twin_offset + n_rows]:
+                return True
+        return False
+
+    def dedup_twins(self, paths, open_member=None):
+        """
+        Find the resources published in several formats, grouping the files by folder and name without extension
+        (so by resource and '_v' version), and keep the one in the format cheapest to parse.
+
+        Parameters:
+        - paths (list): Paths of the files, or member names of an archive.
+        - open_member (callable): Opens a member of the archive, None for files on disk. Only used by check_twins.
+
+        Returns:
+        - tuple: (paths kept, in their order, dict of the skipped twins and the file kept in their place).
+        """
+        groups = {}
+        for path in paths:
+            stem, extension = os.path.splitext(path)
+            if extension.lower() in self.twin_preference:
+                groups.setdefault(stem, []).append(path)
+
+        skipped = {}
+        for twins in groups.values():
+            twins = sorted(twins, key=lambda twin: self.twin_preference.index(os.path.splitext(twin)[1].lower()))
+            for twin in twins[1:]:
+                if self.check_twins and not self.same_twins(twins[0], twin, open_member):
+                    print(f"{Fore.YELLOW}{twin} differs from {twins[0]}, both are processed{Style.RESET_ALL}")
+                    continue
+                skipped[twin] = twins[0]
+        for twin, path in skipped.items():
+            print(f"{Fore.YELLOW}{twin} skipped, twin of {path}{Style.RESET_ALL}")
+        return [path for path in paths if path not in skipped], skipped
+
     def process_all_files(self):
-        for path in self.paths:
+        self.bad_lines_reports = []
+        self.profiler.reset()
+        paths = self.paths
+        if self.skip_twins:
+            paths, self.skipped_twins = self.dedup_twins(paths)
+        if self.workers is not None:
+            # each worker writes its own file in data/prep_datasets
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self.process_path, path) for path in paths]
+                for path, future in zip(paths, futures):
+                    try:
+                        processed, error, bad_lines, stages = future.result()
+                    except Exception as e:
+                        processed, error, bad_lines, stages = False, f"{type(e).__name__}: {e}", None, []
+                    self.profiler.add(stages)
+                    self.print_result(path, processed, error, bad_lines)
+            self.evict_prep_cache()
+            return
+
+        for path in paths:
             print("---------------------------------------------------")
             print(Fore.GREEN + path + Style.RESET_ALL)
-            df = self.open_df(path)
-            print('this is df')
-            display(df)
-            if df is not None:
-                df = self.transposed(df)
-                df = self.drop_empty_columns(df)
-                df = self.columns_formatter(df)
-                df = self.check_column_clean(df)
-                df = self.rename_duplicate_columns(df)
-                self.return_csv(df, path)
-                print(Fore.GREEN + f"{path} processed successfully!" + Style.RESET_ALL)
-                print("---------------------------------------------------")
-            else:
-                print(Fore.RED + f"{path} not processed!" + Style.RESET_ALL)
-                print("---------------------------------------------------")
-    
-    def process_zip_file(self, zip_file):
+            processed, error, bad_lines, _ = self.process_path(path)
+            self.print_result(path, processed, error, bad_lines)
+        self.evict_prep_cache()
+
+    def write_run_report(self, path):
+        """
+        Write the stages of the last run (process_all_files or process_zip_file) as a run report, one record per
+        stage of each file: Parquet if path ends with '.parquet', JSON otherwise. profiler.summary() gives the
+        stages and profiler.summary('path') the files taking the most time.
+        """
+        self.profiler.save(path)
+
+    def evict_prep_cache(self):
+        # the cache is trimmed once per run, by the main process
+        if self.prep_cache is not None:
+            removed = self.prep_cache.evict()
+            if removed:
+                print(Fore.YELLOW + f"{removed} entries evicted from the prep cache" + Style.RESET_ALL)
+
+    def prep_member_name(self, path, sheet=None):
+        """
+        Name of a prepped file (or of one of its sheets) in the output archive, the same as replace_char_in_filename
+        gives for CSV files.
+        """
+        path = self.sheet_name(path, sheet)
+        return path.replace(' ', '_').replace('-', '_').replace(".", "_") + self.output_extension
+
+    def process_zip_file_parallel(self, filtered_list, zip_file, temp_zip):
+        """
+        Spread the members of the archive over a pool of processes. Each worker opens its own copy of the
+        archive and writes its member to a temporary file, and the results are added to the output archive
+        in the order of the input one.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = zip_file.filename
+            if zip_path is None or not os.path.exists(zip_path):
+                # the archive is in memory, the workers read it from a temporary copy
+                zip_path = os.path.join(temp_dir, 'input.zip')
+                zip_file.fp.seek(0)
+                with open(zip_path, 'wb') as f:
+                    shutil.copyfileobj(zip_file.fp, f)
+
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                output_dirs = [os.path.join(temp_dir, str(index)) for index in range(len(filtered_list))]
+                futures = [executor.submit(self.process_member, zip_path, path, output_dir)
+                           for path, output_dir in zip(filtered_list, output_dirs)]
+                for path, output_dir, future in zip(filtered_list, output_dirs, futures):
+                    try:
+                        processed, error, bad_lines, names, stages = future.result()
+                    except Exception as e:
+                        processed, error, bad_lines, names, stages = False, f"{type(e).__name__}: {e}", None, [], []
+                    self.profiler.add(stages)
+                    if processed:
+                        for name in names:
+                            temp_zip.write(os.path.join(output_dir, name), name)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                    self.print_result(path, processed, error, bad_lines)
+
+    def process_zip_file(self, zip_file, output=None):
+        """
+        Prep every member of an archive into a new archive, written in a single pass with the final member names.
+
+        Parameters:
+        - zip_file (zipfile.ZipFile): Archive of raw files.
+        - output (str or file object): Path or writable binary file (e.g. an upload stream) the archive is
+          written to. If None, a temporary file is used, kept in memory while it is smaller than spool_size.
+
+        Returns:
+        - The output archive, rewound when it is a seekable file.
+        """
         file_list = [file for file in zip_file.namelist()]
         filtered_list = list(filter(lambda x: not x.endswith('/'), file_list))
-        output_zip = io.BytesIO()
+        output_zip = output
+        if output_zip is None:
+            output_zip = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        self.bad_lines_reports = []
+        self.profiler.reset()
+        if self.skip_twins:
+            filtered_list, self.skipped_twins = self.dedup_twins(filtered_list, zip_file.open)
 
         with zipfile.ZipFile(output_zip, 'w') as temp_zip:
-            for path in filtered_list:
-                print(Fore.GREEN + 'current:', path + Style.RESET_ALL)
-                with zip_file.open(path) as file:
-                    print("---------------------------------------------------")
-                    print(Fore.GREEN + path + Style.RESET_ALL)
-                    if path == '.DS_Store':
-                        print(Fore.RED + f"{path} not processed!" + Style.RESET_ALL)
-                        print("---------------------------------------------------")
-                        continue
-                    df = self.open_df(path, file)
-                    print('this is df')
-                    if df is not None:
-                        df = self.transposed(df)
-                        df = self.drop_empty_columns(df)
-                        df = self.columns_formatter(df)
-                        df = self.check_column_clean(df)
-                        df = self.rename_duplicate_columns(df)
-
-                        csv_output = io.StringIO()
-                        df.to_csv(csv_output, index=False, sep=";")
-                        csv_output.seek(0)
-
-                        # Ajouter le CSV à l'archive temporaire
-                        temp_zip.writestr(path, csv_output.getvalue())
-
-                        print(Fore.GREEN + f"{path} processed successfully!" + Style.RESET_ALL)
-                        print("---------------------------------------------------")
-                    else:
-                        print(Fore.RED + f"{path} not processed!" + Style.RESET_ALL)
+            if self.workers is not None:
+                self.process_zip_file_parallel(filtered_list, zip_file, temp_zip)
+            else:
+                for path in filtered_list:
+                    print(Fore.GREEN + 'current:', path + Style.RESET_ALL)
+                    with zip_file.open(path) as file:
                         print("---------------------------------------------------")
+                        print(Fore.GREEN + path + Style.RESET_ALL)
+                        # the file is written to the archive as it is produced, under its final name
+                        open_output = lambda sheet=None, suffix='': temp_zip.open(self.prep_member_name(path, sheet) + suffix, 'w')
+                        try:
+                            processed, error = self.process_file(path, file, open_output), None
+                        except Exception as e:
+                            processed, error = False, f"{type(e).__name__}: {e}"
+                        self.print_result(path, processed, error, self.file_bad_lines(path))
+        self.evict_prep_cache()
 
-        # Retourner le fichier zip temporaire en mémoire
-        output_zip.seek(0)
-        output_zip = self.replace_char_in_filename(output_zip)
-        output_zip.seek(0)
+        # Retourner le fichier zip temporaire
+        if hasattr(output_zip, 'seekable') and output_zip.seekable():
+            output_zip.seek(0)
         return output_zip
     
     def replace_char_in_filename(self, zip_file):
@@ -340,8 +1107,8 @@ class PrepFilesBQ:
                     
 class PrepDataCnilBQ(PrepFilesBQ):
 
-    def __init__(self, paths):
-        super().__init__(paths)
+    def __init__(self, paths=None, **kwargs):
+        super().__init__(paths, **kwargs)
 
     def transposed(self, df):
         if df.shape[1] > df.shape[0]:
@@ -373,7 +1140,7 @@ class PrepDataCnilBQ(PrepFilesBQ):
                 column = re.sub(r'[!\"$()\*\.,\/;?\@\[\]\\^`{}\~]', '', column)
                 column = column.strip().lower().replace(" ", "_")
                 column = unidecode(column)
-                column = column.replace("\n", "_")
+                column = column.replace("\r\n", "_").replace("\n", "_").replace("\r", "_")
                 column = column.replace("'", "")
                 column = column.replace("-", "")
                 column = column.replace("&", 'and')
@@ -7,6 +7,9 @@ import urllib3
 from google.oauth2 import service_account
 from google.cloud import storage, bigquery
 import re
+from concurrent.futures import ThreadPoolExecutor
+from classes.catalog_store import CatalogStore
+from classes.archive_manifest import ArchiveManifest
 
 class GetSourceCatalog:
     """
@@ -40,15 +43,77 @@ class GetSourceCatalog:
             print('Request failed with this error:', response.status_code)
             return []
     
+    def next_page_url(self, data):
+        """
+        Find the URL of the next page in a paginated catalog response.
+
+        Parameters:
+        - data (dict): JSON-LD page returned by the API.
+
+        Returns:
+        - str: URL of the next page, or None if it is the last one.
+        """
+        views = [data.get('hydra:view'), data.get('view')]
+        views += [item for item in data.get('@graph', []) if 'PartialCollectionView' in str(item.get('@type'))]
+        for view in views:
+            if not isinstance(view, dict):
+                continue
+            for key in ('next', 'hydra:next'):
+                next_url = view.get(key)
+                if isinstance(next_url, dict):
+                    next_url = next_url.get('@id')
+                if next_url:
+                    return next_url
+        return None
+
+    def fetch_pages_from_api(self, page_size=None):
+        """
+        Fetch the catalog page by page, following the pagination links of the API.
+
+        Parameters:
+        - page_size (int): Number of items requested per page, the API default is used if None.
+
+        Yields:
+        - dict: One parsed page of the catalog at a time.
+        """
+        url = self.api_url
+        params = {'page_size': page_size} if page_size is not None else None
+        seen_urls = set()
+        while url is not None and url not in seen_urls:
+            seen_urls.add(url)
+            response = requests.get(url, headers=self.headers, params=params)
+            if response.status_code != 200:
+                print('Request failed with this error:', response.status_code)
+                return
+            print('Request is a success:', response.status_code, url)
+            data = response.json()
+            url = self.next_page_url(data)
+            # the next link already carries the query string
+            params = None
+            yield data
+
+    def fetch_rows_from_api(self, page_size=None):
+        """
+        Fetch the catalog rows one at a time, only one page is held in memory.
+
+        Parameters:
+        - page_size (int): Number of items requested per page, the API default is used if None.
+
+        Yields:
+        - dict: One item of the @graph array at a time.
+        """
+        for data in self.fetch_pages_from_api(page_size):
+            yield from data.get('@graph', [])
+
     def response_to_dataframe(self, data, table_name, download_url, 
                               table_id=None, file_format=None, last_update=None, 
                               dataset_id=None, dataset_name=None,
-                              frequency=None, accessURL=None):
+                              frequency=None, accessURL=None, batch_size=10000):
         """
         Process API response data into a DataFrame.
 
         Parameters:
-        - data (list): List of catalog data.
+        - data (list or generator): List of catalog data, or the rows yielded by fetch_rows_from_api.
         - table_name (str): Key for table name in each catalog entry.
         - download_url (str): Key for download URL in each catalog entry.
         - table_id (str): Key for table ID in each catalog entry.
@@ -58,10 +123,12 @@ class GetSourceCatalog:
         - dataset_name (str): Key for dataset name in each catalog entry.
         - frequency (str): Key for frequency information in each catalog entry.
         - accessURL (str): Key for access URL in each catalog entry.
+        - batch_size (int): Number of catalog entries converted to a DataFrame at once.
 
         Returns:
         - pd.DataFrame: Processed catalog data in a DataFrame.
         """
+        batches = []
         processed_data = []
         for table in data:
             content = {
@@ -76,8 +143,13 @@ class GetSourceCatalog:
                 'frequency': table.get(frequency)
             }
             processed_data.append(content)
-          
-        self.df_catalog = pd.DataFrame(processed_data).sort_values(by=['last_update', 'table_name', 'download_URL'], ascending=False)
+            if len(processed_data) >= batch_size:
+                batches.append(pd.DataFrame(processed_data))
+                processed_data = []
+        if processed_data or not batches:
+            batches.append(pd.DataFrame(processed_data))
+
+        self.df_catalog = pd.concat(batches, ignore_index=True).sort_values(by=['last_update', 'table_name', 'download_URL'], ascending=False)
         return self.df_catalog
     
     def save_to_csv(self, filename):
@@ -93,95 +165,137 @@ class GetSourceCatalog:
         self.df_catalog.to_csv(path, index=False)
         print("CSV file has been loaded to this path", path)
 
+    def save_to_parquet(self, filename):
+        """
+        Save catalog data as today's Parquet snapshot in data/catalog, see CatalogStore.
+
+        Parameters:
+        - filename (str): The name of the catalog, used as the prefix of the snapshot file.
+
+        Returns:
+        - str: Path of the Parquet file.
+        """
+        return CatalogStore(filename).save(self.df_catalog)
+
 
 class CustomCatalog:
 
-    def __init__(self, credentials_path, project_id=None, dataset_name=None):
+    def __init__(self, credentials_path, project_id=None, dataset_name=None, bq_client=None):
+        """
+        Initialize the CustomCatalog object.
+
+        Parameters:
+        - credentials_path (str): Path of the service account file, unused when bq_client is given.
+        - project_id (str): Google Cloud project ID.
+        - dataset_name (str): BigQuery dataset name.
+        - bq_client (bigquery.Client): Client to use instead of creating one, e.g. benchmarks.fake_clients.FakeBigQueryClient.
+        """
         self.project_id = project_id
-        self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        self.bq_client = bigquery.Client(credentials=self.credentials, project=self.project_id)
+        if bq_client is None:
+            self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
+            bq_client = bigquery.Client(credentials=self.credentials, project=self.project_id)
+        self.bq_client = bq_client
         self.dataset_name = dataset_name
         
 
     def create_catalog_gcs(self, zip_file):
-        file_list = [file for file in zip_file.namelist()]
-        catalog = []
-        filtered_list = list(filter(lambda x: not x.endswith('/'), file_list))
-        for filename in filtered_list:
-            filename_bq = filename.split('/')[1]
-            pattern = "_v(?=\d{4})"
-            split_name = re.split(pattern, filename_bq)
-            filename_bq = unidecode(split_name[0]).lower()
-            date_ext = split_name[1]
-            date_ext = date_ext.replace('.csv', '')
-            if "_csv" in date_ext:
-                ext = "csv"
-                date_date = date_ext.split('_')[0] + '-' + date_ext.split('_')[1] + '-' + date_ext.split('_')[2]
-            elif "_xlsx" in date_ext:
-                ext = "xlsx"
-                date_date = date_ext.split('_')[0] + '-' + date_ext.split('_')[1] + '-' + date_ext.split('_')[2]
-            else:
-                ext = "no extension"
-                date_date = date_ext
-
-            table_name = self.dataset_name + "." + filename_bq
-            dict_table = {
-                'filename': filename_bq,
-                'updated_at': date_date,
-                'source_format': ext,
-                'bq_dest_table': table_name
-                }
-            catalog.append(dict_table)
-        
-        df = pd.DataFrame(catalog)
-        return df
+        df = ArchiveManifest(zip_file).parse(self.dataset_name)
+        return df[['filename', 'updated_at', 'source_format', 'bq_dest_table']]
     
-    def bq_catalog_all_datasets(self):
+    def split_dataset_id(self, dataset_id):
+        """
+        Split a dataset ID into its project and dataset parts.
+
+        Parameters:
+        - dataset_id (str): 'dataset' or 'project.dataset'.
+
+        Returns:
+        - tuple: (project, dataset), the project of the client is used when it is missing.
+        """
+        if '.' in dataset_id:
+            project, dataset = dataset_id.split('.', 1)
+            return project, dataset
+        return self.project_id or self.bq_client.project, dataset_id
+
+    def bulk_tables_metadata(self, dataset_ids):
+        """
+        Get the table IDs and modified dates of several datasets with a single metadata query on __TABLES__.
+
+        Parameters:
+        - dataset_ids (list): IDs of the datasets.
+
+        Returns:
+        - pd.DataFrame: Columns bq_dataset, bq_table and bq_modified.
+        """
+        selects = []
+        for dataset_id in dataset_ids:
+            project, dataset = self.split_dataset_id(dataset_id)
+            selects.append(f"SELECT dataset_id, table_id, TIMESTAMP_MILLIS(last_modified_time) AS modified "
+                           f"FROM `{project}.{dataset}.__TABLES__`")
+        rows = []
+        if selects:
+            rows = [(row['dataset_id'], row['table_id'], row['modified'])
+                    for row in self.bq_client.query('\nUNION ALL\n'.join(selects)).result()]
+        return pd.DataFrame(rows, columns=['bq_dataset', 'bq_table', 'bq_modified'])
+
+    def threaded_tables_metadata(self, dataset_ids, max_workers=8):
+        """
+        Get the table IDs and modified dates of several datasets with one get_table call per table,
+        spread over a bounded pool of threads.
+
+        Parameters:
+        - dataset_ids (list): IDs of the datasets.
+        - max_workers (int): Maximum number of API calls running at the same time.
+
+        Returns:
+        - pd.DataFrame: Columns bq_dataset, bq_table and bq_modified.
+        """
+        def get_table(table_item):
+            table = self.bq_client.get_table(table_item.reference)
+            return table.dataset_id, table.table_id, table.modified
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tables_lists = executor.map(lambda dataset_id: list(self.bq_client.list_tables(dataset_id)), dataset_ids)
+            table_items = [table_item for tables_list in tables_lists for table_item in tables_list]
+            rows = list(executor.map(get_table, table_items))
+        return pd.DataFrame(rows, columns=['bq_dataset', 'bq_table', 'bq_modified'])
+
+    def tables_metadata(self, dataset_ids, max_workers=8):
+        """
+        Get the table IDs and modified dates of several datasets, with a single metadata query when
+        possible, and with threaded get_table calls otherwise.
+
+        Parameters:
+        - dataset_ids (list): IDs of the datasets.
+        - max_workers (int): Maximum number of API calls running at the same time in the fallback.
+
+        Returns:
+        - pd.DataFrame: Columns bq_dataset, bq_table and bq_modified.
+        """
+        try:
+            df = self.bulk_tables_metadata(dataset_ids)
+        except Exception as e:
+            print(f"Metadata query failed ({e}), falling back to get_table calls")
+            df = self.threaded_tables_metadata(dataset_ids, max_workers)
+        df['bq_table'] = df['bq_table'].str.lower()
+        df['bq_modified'] = pd.to_datetime(df['bq_modified'], utc=True)
+        return df
+
+    def bq_catalog_all_datasets(self, max_workers=8):
         print('Getting BigQuery modified dates...')
 
-        dataset_list = list(self.bq_client.list_datasets())
-        dataset_ids = []
-        table_ids = []
-        modified_dates = []
-        for dataset_item in dataset_list:
-            dataset = self.bq_client.get_dataset(dataset_item.reference)
-            tables_list = list(self.bq_client.list_tables(dataset))
-
-            for table_item in tables_list:
-                table = self.bq_client.get_table(table_item.reference)
-                dataset_ids.append(dataset.dataset_id)
-                table_ids.append(table.table_id.lower())
-                modified_dates.append(table.modified)
-        data = {
-            'bq_dataset': dataset_ids,
-            'bq_table': table_ids,
-            'bq_modified': modified_dates
-        }
+        dataset_ids = [dataset_item.dataset_id for dataset_item in self.bq_client.list_datasets()]
+        self.df_bq = self.tables_metadata(dataset_ids, max_workers)
         print('Done.')
-        self.df_bq = pd.DataFrame(data)
         self.df_bq['bq_modified'] = self.df_bq['bq_modified'].dt.tz_localize(None)
         self.df_bq['bq_table'] = self.df_bq['bq_table'].str.replace(r'_\d{8}', '', regex=True)
     
-    def bq_raw_catalog(self):
+    def bq_raw_catalog(self, max_workers=8):
         print('Getting BigQuery modified dates...')
 
-        table_ids = []
-        modified_dates = []
-        tables_list = list(self.bq_client.list_tables(self.dataset_name))
-
-        for table_item in tables_list:
-            table = self.bq_client.get_table(table_item.reference)
-            table_ids.append(table.table_id.lower())
-            modified_dates.append(table.modified)
-
-        data = {
-            'bq_dataset': self.dataset_name,
-            'bq_table': table_ids,
-            'bq_modified': modified_dates
-            }
+        df = self.tables_metadata([self.dataset_name], max_workers)
+        df['bq_dataset'] = self.dataset_name
         print('Done.')
-
-        df = pd.DataFrame(data)
         return df
 
             
@@ -215,16 +329,54 @@ class GetCnilCatalog(GetSourceCatalog):
             print(f"Error when loading CSV file : {e}")
             return None
         
+    def find_dataset_id(self, access_url):
+        """
+        Find the first dataset ID contained in an access URL by scanning every dataset ID.
+
+        Parameters:
+        - access_url (str): Access URL of a catalog entry.
+
+        Returns:
+        - str: First ID of df_dataset found in the URL, or None.
+        """
+        for dataset_id in self.df_dataset.id:
+            if dataset_id in access_url:
+                return dataset_id
+        return None
+
     def identify_datasets_info(self): 
         """
         Identify dataset information and add it to the catalog DataFrame.
+
+        Dataset IDs are 24 hexadecimal characters, so every candidate ID is extracted from the access
+        URLs with one pattern and looked up in an index of df_dataset. When several IDs are found
+        in a URL, the one coming first in df_dataset is kept, like find_dataset_id does. A URL without
+        candidate can't contain an ID, only the URLs with hexadecimal runs longer than an ID (which may
+        hold one) fall back to find_dataset_id, and every URL does when some IDs aren't 24 hexadecimal
+        characters.
         """
-        def find_dataset_id(row):
-            for dataset_id in self.df_dataset.id:
-                if dataset_id in row['accessURL']:
-                    return dataset_id
+        access_urls = self.df_catalog['accessURL'].reset_index(drop=True)
+        dataset_ids = self.df_dataset.id.drop_duplicates().reset_index(drop=True)
+
+        if dataset_ids.astype(str).str.fullmatch(r'[0-9a-f]{24}').all():
+            # position of each dataset ID in df_dataset, to keep the same first match as the scan
+            ranks = pd.Series(dataset_ids.index, index=dataset_ids.values)
+            candidates = access_urls.str.extractall(r'([0-9a-f]{24,})')[0]
+            candidates.index = candidates.index.get_level_values(0)
+            too_long = candidates.str.len() > 24
+            candidate_ranks = candidates[~too_long].map(ranks).dropna()
+            best_ranks = candidate_ranks.groupby(level=0).min().astype(int)
+
+            matches = pd.Series(None, index=access_urls.index, dtype=object)
+            matches[best_ranks.index] = dataset_ids.values[best_ranks.values]
+            fallback = pd.Series(False, index=access_urls.index)
+            fallback[candidates.index[too_long]] = True
+        else:
+            matches = pd.Series(None, index=access_urls.index, dtype=object)
+            fallback = access_urls.notna()
 
-        self.df_catalog['dataset_id'] = self.df_catalog.apply(lambda row: find_dataset_id(row), axis=1)
+        matches[fallback] = access_urls[fallback].map(self.find_dataset_id)
+        self.df_catalog['dataset_id'] = matches.values
         return self.df_catalog
 
     def merge_additional_info(self):
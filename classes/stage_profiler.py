@@ -0,0 +1,192 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+class Stage:
+    """
+    Measures of one stage of the prep of a file, filled by StageProfiler.stage.
+
+    Attributes:
+    - path (str): File being prepped, None outside of a file.
+    - name (str): Name of the stage, e.g. 'open' or 'write'.
+    - seconds (float): Wall time of the stage.
+    - rows_in, columns_in (int): Shape of the DataFrame given to the stage, None if it has none.
+    - rows_out, columns_out (int): Shape of the DataFrame it returned, None if it has none.
+    - peak_memory (int): Peak of the memory allocated during the stage in bytes, above the memory allocated
+      before it. None unless memory is traced.
+    """
+
+    fields = ['path', 'stage', 'seconds', 'rows_in', 'columns_in', 'rows_out', 'columns_out', 'peak_memory']
+
+    def __init__(self, path, name, df=None):
+        self.path = path
+        self.name = name
+        self.seconds = None
+        self.rows_in, self.columns_in = self.shape(df)
+        self.rows_out, self.columns_out = None, None
+        self.peak_memory = None
+
+    def shape(self, df):
+        # shape of a DataFrame, or of the sheets of an Excel file read as a dict of DataFrames
+        if isinstance(df, pd.DataFrame):
+            return df.shape
+        if isinstance(df, dict) and df:
+            return sum(sheet.shape[0] for sheet in df.values()), max(sheet.shape[1] for sheet in df.values())
+        return None, None
+
+    def output(self, df=None, rows=None):
+        """
+        Record the shape of the DataFrame returned by the stage, or only its number of rows.
+        """
+        self.rows_out, self.columns_out = self.shape(df)
+        if rows is not None:
+            self.rows_out = rows
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'stage': self.name,
+            'seconds': self.seconds,
+            'rows_in': self.rows_in,
+            'columns_in': self.columns_in,
+            'rows_out': self.rows_out,
+            'columns_out': self.columns_out,
+            'peak_memory': self.peak_memory
+        }
+
+
+class StageProfiler:
+    """
+    Class for timing the stages of the prep of each file (open, sniff, transpose, drop_empty, format, dedupe,
+    write...) and measuring the DataFrames going through them.
+
+    Stages may be nested, e.g. sniff inside open, and the 'file' stage spans the whole prep of a file. The peak
+    memory is measured with tracemalloc, which slows the prep down noticeably, so only when trace_memory is set.
+
+    Attributes:
+    - trace_memory (bool): Whether the peak memory of each stage is measured.
+    - hook (callable): Called with the dict of each stage recorded, e.g. to send it to a monitoring system.
+    - records (list): Dicts of the stages recorded, see Stage.
+    - path (str): File being prepped.
+
+    Methods:
+    - __init__(trace_memory, hook): Constructor method that initializes an empty profiler.
+    - reset(): Forgets the stages recorded.
+    - file(path): Context manager setting the file being prepped, recorded as a 'file' stage.
+    - stage(name, df): Context manager measuring a stage.
+    - add(records): Adds stages recorded by another profiler, e.g. in a worker process.
+    - to_frame(): Returns the stages recorded as a DataFrame.
+    - summary(by): Total time and peak memory per stage or per file, the slowest first.
+    - save(path): Writes the stages recorded as a JSON or Parquet run report.
+    """
+
+    def __init__(self, trace_memory=False, hook=None):
+        """
+        Initialize the StageProfiler object.
+
+        Parameters:
+        - trace_memory (bool): Whether the peak memory of each stage is measured with tracemalloc.
+        - hook (callable): Called with the dict of each stage recorded. With worker processes it is called
+          by the main process, once the file is processed.
+        """
+        self.trace_memory = trace_memory
+        self.hook = hook
+        self.records = []
+        self.path = None
+        # peak memory of the stages being measured, the innermost last
+        self.peaks = []
+
+    def __getstate__(self):
+        # hooks are often lambdas, which can't be sent to worker processes: workers return their stages instead
+        state = self.__dict__.copy()
+        state['hook'] = None
+        state['records'] = []
+        return state
+
+    def reset(self):
+        self.records = []
+
+    @contextmanager
+    def file(self, path):
+        """
+        Set the file the stages are recorded for, and record the whole prep of the file as a 'file' stage.
+        """
+        previous = self.path
+        self.path = path
+        try:
+            with self.stage('file') as stage:
+                yield stage
+        finally:
+            self.path = previous
+
+    @contextmanager
+    def stage(self, name, df=None):
+        """
+        Measure a stage, recorded even if it raises an exception.
+
+        Parameters:
+        - name (str): Name of the stage.
+        - df (pd.DataFrame): DataFrame given to the stage, if any.
+
+        Yields:
+        - Stage: Measures of the stage, whose output() records the DataFrame returned by the stage.
+        """
+        stage = Stage(self.path, name, df)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.peaks.append(current)
+            start_memory = current
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            if self.trace_memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                stage.peak_memory = peak - start_memory
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            self.add([stage.to_dict()])
+
+    def add(self, records):
+        """
+        Add stages recorded as dicts, and call the hook with each of them.
+        """
+        for record in records:
+            self.records.append(record)
+            if self.hook is not None:
+                self.hook(record)
+
+    def to_frame(self):
+        counts = ['rows_in', 'columns_in', 'rows_out', 'columns_out', 'peak_memory']
+        return pd.DataFrame(self.records, columns=Stage.fields).astype({column: 'Int64' for column in counts})
+
+    def summary(self, by='stage'):
+        """
+        Total time and peak memory of the stages recorded, grouped by 'stage' or by 'path', the slowest first.
+        The 'file' stages are left out of the summary by stage, since they hold the others.
+        """
+        df = self.to_frame()
+        if by == 'stage':
+            df = df[df['stage'] != 'file']
+        else:
+            df = df[df['stage'] == 'file']
+        return df.groupby(by, dropna=False).agg(seconds=('seconds', 'sum'), calls=('seconds', 'size'),
+                                                peak_memory=('peak_memory', 'max')).sort_values('seconds', ascending=False)
+
+    def save(self, path):
+        """
+        Write the stages recorded as a run report: Parquet if path ends with '.parquet', JSON (a list of records) otherwise.
+        """
+        if path.endswith('.parquet'):
+            self.to_frame().to_parquet(path, index=False)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.records, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,234 @@
+import requests
+import hashlib
+import os
+import re
+
+class StreamDownloader:
+    """
+    Class for streaming HTTP downloads to disk with a bounded memory footprint.
+
+    The body is written chunk by chunk to a '.part' file next to the destination. When a '.part'
+    file already exists, the download resumes from its size with an HTTP Range request, guarded by
+    an If-Range header holding the ETag (or Last-Modified date) of the response it comes from, saved
+    in a '.part.validator' file: if the remote file changed meanwhile, the server sends it in full.
+    A '.part' file without validator can't be resumed safely and is downloaded again. The file is
+    only moved to its final path once its length (and optionally its checksum) has been verified.
+
+    Attributes:
+    - session (requests.Session): Session used for the HTTP requests.
+    - chunk_size (int): Size in bytes of the chunks read from the response and written to disk.
+    - timeout (int): Timeout in seconds of each HTTP request.
+
+    Methods:
+    - __init__(session, chunk_size, timeout): Constructor method that initializes the downloader.
+    - hash_file(path, hasher): Helper method to feed an existing file into a hash object.
+    - expected_length(response, offset): Helper method to read the total length announced by the server.
+    - validator(response): Helper method to read the validator of a response usable in If-Range.
+    - download(url, path, headers, checksum, restart): Streams a URL to a local file and returns its result.
+    - download_to(url, open_output, headers, checksum): Streams a URL to a writable file, e.g. a GCS upload.
+    - result(response, size, digest, resumed): Helper method to build the result of a download.
+    """
+
+    def __init__(self, session=None, chunk_size=1024 * 1024, timeout=300):
+        """
+        Initialize the StreamDownloader object.
+
+        Parameters:
+        - session (requests.Session): Session used for the HTTP requests, a new one is created if None.
+        - chunk_size (int): Size in bytes of the chunks read from the response and written to disk.
+        - timeout (int): Timeout in seconds of each HTTP request.
+        """
+        self.session = session if session is not None else requests.Session()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def hash_file(self, path, hasher):
+        """
+        Feed an existing file into a hash object, one chunk at a time.
+
+        Parameters:
+        - path (str): Path of the file to hash.
+        - hasher (hashlib object): Hash object to update.
+        """
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hasher.update(chunk)
+
+    def expected_length(self, response, offset):
+        """
+        Read the total length of the file announced by the server.
+
+        Parameters:
+        - response (requests.Response): Streamed response.
+        - offset (int): Number of bytes already on disk before the request.
+
+        Returns:
+        - int: Expected size of the complete file, or None if it can't be known.
+        """
+        if response.headers.get('Content-Encoding'):
+            # requests decodes the body, Content-Length is the size of the encoded body
+            return None
+        if response.status_code == 206:
+            match = re.match(r'bytes (\d+)-\d+/(\d+)', response.headers.get('Content-Range', ''))
+            if match:
+                return int(match.group(2))
+        length = response.headers.get('Content-Length')
+        if length is not None:
+            return offset + int(length)
+        return None
+
+    def validator(self, response):
+        """
+        Read the validator of a response that can be sent in an If-Range header.
+
+        Parameters:
+        - response (requests.Response): Response of a download request.
+
+        Returns:
+        - str: Strong ETag, or Last-Modified date if there is none (weak ETags aren't allowed in If-Range), or None.
+        """
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    def download(self, url, path, headers=None, checksum=None, restart=True):
+        """
+        Stream a URL to a local file, resuming a previous partial download if there is one.
+
+        Parameters:
+        - url (str): URL of the file to download.
+        - path (str): Destination path of the file.
+        - headers (dict): Additional headers sent with the request.
+        - checksum (str): Expected sha256 hex digest of the complete file, not verified if None.
+        - restart (bool): Whether a 416 answer restarts the download from scratch, only once.
+
+        Returns:
+        - dict: Result of the download, see result(). A 304 answer to a conditional request
+          leaves the destination untouched and returns 0 bytes.
+        """
+        part_path = path + '.part'
+        validator_path = part_path + '.validator'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if offset and os.path.exists(validator_path):
+            with open(validator_path, encoding='utf-8') as f:
+                validator = f.read().strip() or None
+        request_headers = dict(headers or {})
+        if offset and validator is not None:
+            request_headers['Range'] = f'bytes={offset}-'
+            request_headers['If-Range'] = validator
+        else:
+            # without validator, the partial file may come from another version of the remote file
+            offset = 0
+
+        response = self.session.get(url, headers=request_headers, stream=True, timeout=self.timeout)
+        with response:
+            if response.status_code == 304:
+                # answer to a conditional request, the local copy is still up to date
+                return self.result(response, 0, None, False)
+            if response.status_code == 416 and restart:
+                # the partial file doesn't match the remote file anymore, start again from scratch, a second
+                # 416 is raised below
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                if os.path.exists(validator_path):
+                    os.remove(validator_path)
+                return self.download(url, path, headers, checksum, restart=False)
+            response.raise_for_status()
+
+            hasher = hashlib.sha256()
+            resumed = response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-')
+            if resumed:
+                self.hash_file(part_path, hasher)
+                mode = 'ab'
+            else:
+                # a full answer, e.g. to an If-Range whose file changed, restarts the partial file
+                offset = 0
+                mode = 'wb'
+                new_validator = self.validator(response)
+                if new_validator is not None:
+                    with open(validator_path, 'w', encoding='utf-8') as f:
+                        f.write(new_validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+
+            expected = self.expected_length(response, offset)
+            size = offset
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+
+        if expected is not None and size != expected:
+            raise IOError(f"Incomplete download of {url}: {size} bytes received, {expected} expected")
+        digest = hasher.hexdigest()
+        if checksum is not None and digest != checksum.lower():
+            os.remove(part_path)
+            if os.path.exists(validator_path):
+                os.remove(validator_path)
+            raise IOError(f"Checksum mismatch for {url}: got {digest}, expected {checksum}")
+        os.replace(part_path, path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        return self.result(response, size, digest, resumed)
+
+    def download_to(self, url, open_output, headers=None, checksum=None):
+        """
+        Stream a URL to a writable file object, e.g. a GCS blob opened for writing, one chunk at a time.
+
+        The length and the checksum are verified before the output is closed, so an output which cancels
+        what was written when it exits on an exception (as the writers of blob.open do) is never completed
+        with a truncated body. Downloads can't be resumed, since the output can't be read back.
+
+        Parameters:
+        - url (str): URL of the file to download.
+        - open_output (callable): Called with the Content-Type of the response (None if missing), returns
+          the writable file object, used as a context manager.
+        - headers (dict): Additional headers sent with the request.
+        - checksum (str): Expected sha256 hex digest of the file, not verified if None.
+
+        Returns:
+        - dict: Result of the download, see result().
+        """
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        with response:
+            response.raise_for_status()
+            expected = self.expected_length(response, 0)
+            hasher = hashlib.sha256()
+            size = 0
+            with open_output(response.headers.get('Content-Type')) as output:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    output.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+                if expected is not None and size != expected:
+                    raise IOError(f"Incomplete download of {url}: {size} bytes received, {expected} expected")
+                digest = hasher.hexdigest()
+                if checksum is not None and digest != checksum.lower():
+                    raise IOError(f"Checksum mismatch for {url}: got {digest}, expected {checksum}")
+        return self.result(response, size, digest, False)
+
+    def result(self, response, size, digest, resumed):
+        """
+        Build the result of a download from its response.
+
+        Parameters:
+        - response (requests.Response): Response of the download request.
+        - size (int): Number of bytes of the file on disk.
+        - digest (str): sha256 hex digest of the file on disk.
+        - resumed (bool): Whether a partial download was resumed.
+
+        Returns:
+        - dict: Result with http_status, bytes, sha256, content_type, etag, last_modified and resumed.
+        """
+        return {
+            'http_status': response.status_code,
+            'bytes': size,
+            'sha256': digest,
+            'content_type': response.headers.get('Content-Type'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'resumed': resumed
+        }
@@ -0,0 +1,118 @@
+"""
+Offline tests of the uploads of FromFileToGCS, against the FakeStorageClient of the benchmarks and a local HTTP server.
+"""
+import contextlib
+import http.server
+import io
+import os
+import tempfile
+import threading
+import unittest
+from datetime import date
+from functools import partial
+from unittest import mock
+from benchmarks.fake_clients import FakeStorageClient
+from classes.file_to_gcs import FromFileToGCS
+from classes.stream_download import StreamDownloader
+
+
+def fake_upload_chunks_concurrently(filename, blob, chunk_size, max_workers, worker_type):
+    # stands for the XML multipart upload, which the fake client doesn't implement: the file is sent in chunks
+    with open(filename, 'rb') as f:
+        blob.store('upload_chunks_concurrently', b''.join(iter(lambda: f.read(chunk_size), b'')), None)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class FromFileToGCSTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeStorageClient()
+        self.uploader = FromFileToGCS('bucket', None, storage_client=self.client)
+        self.prefix = str(date.today()) + '/prep/'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.files = {}
+        for index in range(5):
+            content = os.urandom(1000 + index)
+            path = os.path.join(self.temp_dir.name, f'table_{index}.csv')
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.files[path] = content
+
+    def stored(self, blob_name):
+        return self.client.blobs[('bucket', blob_name)][0]
+
+    def test_local_to_gcs_uploads_each_file_under_its_basename(self):
+        for max_workers in (None, 4):
+            self.client.blobs.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = self.uploader.local_to_gcs(list(self.files), 'prep', max_workers=max_workers)
+            self.assertEqual([result['error'] for result in results], [None] * len(self.files))
+            self.assertEqual([result['blob'] for result in results],
+                             [self.prefix + os.path.basename(path) for path in self.files])
+            for path, content in self.files.items():
+                self.assertEqual(self.stored(self.prefix + os.path.basename(path)), content)
+        # the bucket handle built by the constructor is shared by every upload
+        self.assertEqual(self.client.calls['bucket'], 1)
+
+    def test_local_to_gcs_file_objects(self):
+        archive = io.BytesIO(b'PK archive')
+        csv_file = io.BytesIO('a;b\n1;2\n'.encode('utf-8'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.uploader.local_to_gcs([archive], 'prep')
+            self.uploader.local_to_gcs([csv_file], 'prep', dest_blob=['table.csv'])
+        self.assertEqual(self.stored(self.prefix + 'prep_datasets.zip'), b'PK archive')
+        self.assertEqual(self.stored(self.prefix + 'table.csv'), b'a,b\n1,2\n')
+
+    def test_local_to_gcs_reports_failures_without_stopping(self):
+        paths = list(self.files) + [os.path.join(self.temp_dir.name, 'missing.csv')]
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = self.uploader.local_to_gcs(paths, 'prep', max_workers=2)
+        self.assertIsNone(results[0]['error'])
+        self.assertTrue(results[-1]['error'].startswith('FileNotFoundError'))
+        self.assertEqual(len(self.client.blobs), len(self.files))
+
+    def test_upload_file_large_files(self):
+        path = next(iter(self.files))
+        with mock.patch('classes.file_to_gcs.transfer_manager.upload_chunks_concurrently',
+                        side_effect=fake_upload_chunks_concurrently) as upload_chunks:
+            self.uploader.upload_file(path, 'large/chunks.csv', large_file_size=100, chunk_size=256 * 1024, chunk_workers=3)
+        self.assertEqual(upload_chunks.call_args.kwargs['max_workers'], 3)
+        self.assertEqual(self.stored('large/chunks.csv'), self.files[path])
+
+        result = self.uploader.upload_file(path, 'large/resumable.csv', large_file_size=100, chunk_size=256 * 1024)
+        self.assertEqual(result['size'], len(self.files[path]))
+        self.assertEqual(self.stored('large/resumable.csv'), self.files[path])
+
+    def test_stream_url_to_gcs(self):
+        # a body of several upload chunks and a partial last one
+        content = os.urandom(3 * 256 * 1024 + 10)
+        with open(os.path.join(self.temp_dir.name, 'data.zip'), 'wb') as f:
+            f.write(content)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=self.temp_dir.name))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_port}/data.zip'
+
+        result = self.uploader.stream_url_to_gcs(StreamDownloader(chunk_size=64 * 1024), url, 'raw/data.zip',
+                                                 chunk_size=256 * 1024)
+        self.assertEqual(result['bytes'], len(content))
+        self.assertEqual(self.stored('raw/data.zip'), content)
+        self.assertEqual(self.client.calls['upload_chunk'], 3)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = self.uploader.download_and_upload_from_URLs([url, url + '.missing'], 'raw', ['a.zip', 'b.zip'],
+                                                                  stream=True, max_workers=2, chunk_size=256 * 1024)
+        self.assertIsNone(results[0]['error'])
+        self.assertEqual(self.stored(str(date.today()) + '/raw/a.zip'), content)
+        self.assertIsNotNone(results[1]['error'])
+        self.assertNotIn(('bucket', str(date.today()) + '/raw/b.zip'), self.client.blobs)
+
+
+if __name__ == '__main__':
+    unittest.main()